@@ -1,45 +1,141 @@
 import streamlit as st
-from openai import OpenAI
-import sqlite3
 import json
-from datetime import datetime
-
-from prompts import AGENT_SYSTEM_PROMPT, JSON_EXTRACTION_PROMPT, CRITIQUE_PROMPT
-
-# ================= 1. 数据库初始化 =================
-def init_db():
-    conn = sqlite3.connect('tickets.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS tickets (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            engineer_name TEXT,
-            device_sn TEXT,
-            product_line TEXT,
-            fault_type TEXT,
-            start_time TEXT,
-            end_time TEXT,
-            replacements TEXT, 
-            final_report TEXT,
-            ai_critique TEXT,
-            created_at TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from streamlit.errors import StreamlitAPIException
+
+import db
+import drafts
+import jobs
+import metrics
+from context import compact_messages, log_usage, pick_model
+from llm import make_client, response_cache, complete_closure_extraction, run_critique
+from extraction import ClosureStreamParser, parse_extraction
+from prompts import AGENT_SYSTEM_PROMPT, CLOSURE_EXTRACTION_PROMPT
+from scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, scheduled, scheduler
+
+# ================= 1. API 配置 =================
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+client = make_client(st.secrets["MOONSHOT_API_KEY"])
+# 所有会话共用进程级调度器：工程师在等的请求优先，点评排在后面
+chat_client = scheduled(client, PRIORITY_INTERACTIVE)
+background_client = scheduled(client, PRIORITY_BACKGROUND)
+
+# 提交时点评仍未返回，给应用内线程留出的时间；超时或失败后由 worker.py 接手
+IN_APP_CRITIQUE_GRACE = 120
+
+REPLY_TAGS = ("<FINAL_REPORT>", "[打回追问]")
+
+def format_agent_reply(reply):
+    if "<FINAL_REPORT>" in reply:
+        return reply.replace("<FINAL_REPORT>", "### 📄 最终交付报告\n\n").strip()
+    # 如果 AI 没有给出完结信号，强制剥离内部追问标签
+    return reply.replace("[打回追问]", "").strip()
+
+def is_partial_tag(text):
+    # 首批 token 可能只包含半个路由标签，先压住不渲染，避免界面闪出 "<FINAL_REP"
+    head = text.lstrip()
+    return any(tag != head and tag.startswith(head) for tag in REPLY_TAGS)
+
+def stream_agent_reply(messages, placeholder):
+    """流式请求 Agent，逐 token 渲染到 placeholder，返回 (ClosureStreamParser, 延迟统计)。"""
+    started = time.perf_counter()
+    first_token_at = None
+    parser = ClosureStreamParser()
+    usage_chunk = None
+    model = pick_model(messages)
+    stream = chat_client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=0.1, # 极其理性的温度，避免随机发散
+        stream=True,
+    )
+    for chunk in stream:
+        # Moonshot 在最后一个分片里附带 usage（挂在 choice 上），兼容标准 OpenAI 挂在 chunk 上的写法
+        if getattr(chunk, "usage", None) or (chunk.choices and getattr(chunk.choices[0], "usage", None)):
+            usage_chunk = chunk if getattr(chunk, "usage", None) else chunk.choices[0]
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content or ""
+        if not delta:
+            continue
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+        parser.feed(delta)
+        # 闭环附录（提取 JSON）开始后正文停止增长，附录不渲染给工程师
+        visible = parser.visible
+        if visible and not is_partial_tag(visible):
+            placeholder.markdown(format_agent_reply(visible) + " ▌")
 
-init_db()
+    finished = time.perf_counter()
+    latency = {
+        "ttft": (first_token_at or finished) - started,
+        "total": finished - started,
+        "model": model,
+        **log_usage("chat", model, messages, usage_chunk, parser.text),
+    }
+    metrics.record("llm.chat", latency["total"] * 1000, latency["prompt_tokens"], latency["completion_tokens"], model)
+    metrics.record("llm.chat_ttft", latency["ttft"] * 1000, detail=model)
+    return parser, latency
 
-# ================= 2. API 配置 =================
-client = OpenAI(
-    api_key=st.secrets["MOONSHOT_API_KEY"],
-    base_url="https://api.moonshot.cn/v1",
-)
+@st.cache_resource
+def get_llm_executor():
+    # 进程级线程池，跨会话、跨 rerun 复用
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm")
 
+def save_draft_critique(draft_id, future):
+    # 运行在线程池回调里：点评先写进草稿，工程师刷新或换设备恢复时不必重算
+    try:
+        drafts.update(draft_id, ai_critique=future.result())
+    except Exception:
+        pass
+
+def save_late_critique(job_id, ticket_id, future):
+    # 运行在线程池回调里，不能调用任何 st.* 接口
+    try:
+        critique = future.result()
+    except Exception:
+        jobs.release(job_id)
+        return
+    jobs.complete(job_id, ticket_id, jobs.JOB_CRITIQUE, critique, only_if_pending=True)
+
+def rerun_fragment():
+    # 由 fragment 内的交互触发时只重跑该 fragment；整页运行期间不允许 fragment 级重跑，退回整页
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+def keyset_page_cursor(key):
+    # 游标栈：栈顶为当前页的 before_id，None 表示第一页
+    return st.session_state.setdefault(f"{key}_cursors", [None])[-1]
+
+def render_keyset_pager(key, page_rows, has_more):
+    cursors = st.session_state[f"{key}_cursors"]
+    p1, p2, p3 = st.columns([1, 2, 1])
+    if p1.button("⬅️ 上一页", key=f"{key}_prev", disabled=len(cursors) == 1):
+        cursors.pop()
+        rerun_fragment()
+    p2.caption(f"第 {len(cursors)} 页")
+    if p3.button("下一页 ➡️", key=f"{key}_next", disabled=not has_more):
+        cursors.append(page_rows[-1][0])
+        rerun_fragment()
+
+def format_latency(latency):
+    text = f"⏱️ 首字 {latency['ttft']:.2f}s · 总耗时 {latency['total']:.2f}s"
+    if "prompt_tokens" in latency:
+        text += f" · {latency['model']} · 输入 {latency['prompt_tokens']} / 输出 {latency['completion_tokens']} tokens"
+    return text
+
+# 整页 rerun 的耗时在脚本末尾记录；st.rerun() 中途打断的那一轮不计
+rerun_started = time.perf_counter()
 st.set_page_config(page_title="PIA 智能交付与审计系统", page_icon="🤖", layout="wide")
 st.markdown("<style>#MainMenu {visibility: hidden;} footer {visibility: hidden;}</style>", unsafe_allow_html=True)
 
-# ================= 3. 侧边栏：角色路由 =================
+# ================= 2. 侧边栏：角色路由 =================
 with st.sidebar:
     st.header("👤 用户身份")
     role = st.selectbox("请选择您的角色：", ["👨‍🔧 一线工程师 (FE)", "👔 交付总监/PM"])
@@ -48,6 +144,19 @@ with st.sidebar:
         engineer_name = st.text_input("请输入您的姓名/工号：", value="张工")
     st.divider()
 
+    if role == "👔 交付总监/PM":
+        cache_stats = response_cache.stats()
+        st.caption(
+            f"🗄️ LLM 响应缓存（本进程）：命中 {cache_stats['hits_memory'] + cache_stats['hits_disk']}"
+            f"（内存 {cache_stats['hits_memory']} / 磁盘 {cache_stats['hits_disk']}）"
+            f" · 未命中 {cache_stats['misses']} · 命中率 {cache_stats['hit_rate']:.0%}"
+        )
+        sched_stats = scheduler.stats()
+        st.caption(
+            f"🚦 LLM 调度（本进程）：排队 {sched_stats['queue_depth']} · 在途 {sched_stats['in_flight']}"
+            f" · 平均等待 {sched_stats['avg_wait']:.2f}s · P95 等待 {sched_stats['p95_wait']:.2f}s · 重试 {sched_stats['retries']}"
+        )
+
 # =====================================================================
 #                          👨‍🔧 工程师视图 (FE View)
 # =====================================================================
@@ -55,104 +164,139 @@ if role == "👨‍🔧 一线工程师 (FE)":
     st.title(f"🤖 欢迎, {engineer_name}")
     st.caption("硬件交付 PIA 智能复核 Agent | 只有逻辑闭环才能结单。")
     
-    tab_work, tab_history = st.tabs(["💬 当前工单处理", "🗂️ 我的历史工单 (只读)"])
-    
-    with tab_work:
-        if "messages" not in st.session_state:
-            st.session_state.messages = [{"role": "system", "content": AGENT_SYSTEM_PROMPT}]
-            st.session_state.display_messages = [{"role": "assistant", "content": "你好！请描述现场排查流水账。如果有 SN号、换件 QN 码也请一并带上。"}]
-            st.session_state.is_done = False
-            st.session_state.extracted_data = None
-            st.session_state.ai_critique = None
+    # 对话、历史各自是独立的 fragment：在其中交互只重跑这一块，不会带着另一块一起重建
+    @st.fragment
+    @metrics.timed("rerun.chat")
+    def render_chat(engineer_name):
+        # 会话里只记 draft_id，对话内容由 drafts 模块缓存并在每轮后落库，刷新页面或换台设备都能接着聊
+        draft = drafts.load(st.session_state.draft_id) if st.session_state.get("draft_id") is not None else None
+        if draft is None or draft["engineer_name"] != engineer_name:
+            st.session_state.draft_id = None
+            draft = drafts.new_draft(engineer_name, AGENT_SYSTEM_PROMPT + CLOSURE_EXTRACTION_PROMPT)
+
+        open_drafts = drafts.list_open(engineer_name)
+        if open_drafts:
+            draft_labels = {d_id: f"草稿 #{d_id} · 更新于 {d_time} · {d_preview or ''}" for d_id, d_time, d_preview in open_drafts}
+            draft_options = [None] + list(draft_labels)
+            d1, d2 = st.columns([4, 1])
+            chosen_draft = d1.selectbox(
+                "📂 未完成的工单草稿", draft_options,
+                index=draft_options.index(draft["id"]) if draft["id"] in draft_options else 0,
+                format_func=lambda d_id: draft_labels.get(d_id, "➕ 新建工单"),
+            )
+            if chosen_draft != draft["id"]:
+                st.session_state.draft_id = chosen_draft
+                rerun_fragment()
+            if draft["id"] is not None and d2.button("🗑️ 放弃此草稿", use_container_width=True):
+                drafts.close(draft["id"], "discarded")
+                st.session_state.draft_id = None
+                rerun_fragment()
 
         messages_container = st.container(height=450)
         with messages_container:
-            for msg in st.session_state.display_messages:
+            for msg in draft["display_messages"]:
                 with st.chat_message(msg["role"]):
                     st.markdown(msg["content"])
+                    if msg.get("latency"):
+                        st.caption(format_latency(msg["latency"]))
 
-        if not st.session_state.is_done:
+        if not draft["is_done"]:
             if prompt := st.chat_input("请输入现场排查流水账..."):
-                st.session_state.display_messages.append({"role": "user", "content": prompt})
-                st.session_state.messages.append({"role": "user", "content": prompt})
+                turn_started = time.perf_counter()
+                draft["display_messages"].append({"role": "user", "content": prompt})
+                draft["messages"].append({"role": "user", "content": prompt})
                 
                 with messages_container:
                     with st.chat_message("user"):
                         st.markdown(prompt)
 
                     with st.chat_message("assistant"):
-                        with st.spinner("Agent 正在严苛审视排查逻辑..."):
-                            try:
-                                response = client.chat.completions.create(
-                                    model="moonshot-v1-8k",
-                                    messages=st.session_state.messages,
-                                    temperature=0.1, # 极其理性的温度，避免随机发散
-                                )
-                                reply = response.choices[0].message.content
-                                
-                                # 【极度强硬的路由判定器】
-                                if "<FINAL_REPORT>" in reply:
-                                    st.session_state.is_done = True
-                                    reply = reply.replace("<FINAL_REPORT>", "### 📄 最终交付报告\n\n").strip()
-                                else:
-                                    # 如果 AI 没有给出完结信号，强制剥离内部追问标签
-                                    reply = reply.replace("[打回追问]", "").strip()
-                                
-                                st.markdown(reply)
-                                
-                                st.session_state.messages.append({"role": "assistant", "content": reply})
-                                st.session_state.display_messages.append({"role": "assistant", "content": reply})
-                                
-                            except Exception as e:
-                                st.error(f"API 出错：{e}")
+                        placeholder = st.empty()
+                        placeholder.markdown("⏳ Agent 正在严苛审视排查逻辑...")
+                        try:
+                            # 只压缩发给模型的上下文，界面上的 display_messages 保持完整
+                            draft["messages"] = compact_messages(chat_client, draft["messages"])
+                            parser, latency = stream_agent_reply(draft["messages"], placeholder)
+
+                            # 【极度强硬的路由判定器】
+                            if "<FINAL_REPORT>" in parser.report:
+                                draft["is_done"] = True
+                                draft["closure_json"] = parser.json_text
+                                # 闭环端到端：从工程师发出最后一句到表单可以填写
+                                st.session_state.closure_started = turn_started
+                            reply = format_agent_reply(parser.report)
+                            placeholder.markdown(reply)
+
+                            draft["messages"].append({"role": "assistant", "content": reply})
+                            draft["display_messages"].append({"role": "assistant", "content": reply, "latency": latency})
+
+                        except Exception as e:
+                            placeholder.empty()
+                            st.error(f"API 出错：{e}")
                 
+                # 每轮对话后落库；第一句话发出时才真正创建草稿
+                st.session_state.draft_id = drafts.save(draft)
                 # 【终极状态同步】无论走到哪个分支，立刻刷新前端保持状态完全一致
-                st.rerun()
+                rerun_fragment()
 
         # ================= 后台双路提取：JSON 表单 + 技术总监点评 =================
-        if st.session_state.is_done and st.session_state.extracted_data is None:
-            with st.spinner("🔄 逻辑已闭环！正在提取表单数据..."):
+        # 闭环回复自带提取附录且全部字段合法时直接填表；否则只对缺失/不合法部分补请求，与点评同时派发。
+        # 在途请求只存在于本进程：恢复的草稿（或进程重启后）缺哪一路就重新派发哪一路
+        inflight = drafts.inflight(draft["id"]) if draft["is_done"] else {}
+        if draft["is_done"] and draft["final_report"] is None:
+            draft["final_report"] = draft["display_messages"][-1]["content"]
+            drafts.save(draft)
+        if draft["is_done"] and draft["extracted_data"] is None and "extraction" not in inflight:
+            closure_data, invalid = None, None
+            if draft["closure_json"] is not None:
                 try:
-                    extract_msgs = st.session_state.messages.copy()
-                    extract_msgs.append({"role": "user", "content": JSON_EXTRACTION_PROMPT})
-                    json_res = client.chat.completions.create(
-                        model="moonshot-v1-8k", messages=extract_msgs, temperature=0.1
-                    )
-                    raw_json = json_res.choices[0].message.content.strip().replace("```json", "").replace("```", "")
-                    st.session_state.extracted_data = json.loads(raw_json)
-                except Exception as e:
-                    st.error(f"提取表单失败: {e}")
-                    st.session_state.extracted_data = {"replacements": []}
+                    closure_data, invalid = parse_extraction(draft["closure_json"])
+                except ValueError:
+                    pass
+            if closure_data is not None and not invalid:
+                draft["extracted_data"] = closure_data
+                drafts.save(draft)
+            else:
+                inflight["extraction"] = get_llm_executor().submit(
+                    complete_closure_extraction, chat_client, draft["final_report"], draft["closure_json"], draft["messages"].copy()
+                )
+        if draft["is_done"] and draft["ai_critique"] is None and "critique" not in inflight:
+            inflight["critique"] = get_llm_executor().submit(run_critique, background_client, draft["messages"].copy())
+            inflight["critique"].add_done_callback(lambda fut, did=draft["id"]: save_draft_critique(did, fut))
 
-            with st.spinner("🧠 全球顶尖技术总监正在撰写深度复盘报告..."):
+        if draft["is_done"] and draft["extracted_data"] is None:
+            with st.spinner("🔄 逻辑已闭环！正在提取表单数据..."):
                 try:
-                    crit_msgs = st.session_state.messages.copy()
-                    crit_msgs.append({"role": "user", "content": CRITIQUE_PROMPT})
-                    crit_res = client.chat.completions.create(
-                        model="moonshot-v1-8k", messages=crit_msgs, temperature=0.3
-                    )
-                    st.session_state.ai_critique = crit_res.choices[0].message.content
-                    st.session_state.final_report = st.session_state.display_messages[-1]["content"]
+                    draft["extracted_data"] = inflight["extraction"].result()
                 except Exception as e:
-                    st.error(f"生成点评失败: {e}")
-                    st.session_state.ai_critique = "点评生成失败。"
-                st.rerun()
+                    st.error(f"提取表单失败: {e}，提交后将由后台任务补录。")
+                    draft["extracted_data"] = {"replacements": []}
+                    draft["extraction_failed"] = True
+            drafts.save(draft)
+        if draft["extracted_data"] is not None and "closure_started" in st.session_state:
+            metrics.record("closure.e2e", (time.perf_counter() - st.session_state.pop("closure_started")) * 1000)
+
+        critique_future = inflight.get("critique")
+        if draft["is_done"] and draft["ai_critique"] is None and critique_future.done() and critique_future.exception():
+            st.warning(f"生成点评失败: {critique_future.exception()}，提交后将转入后台重试。")
 
         # ================= 工程师核对表单并提交 =================
-        if st.session_state.extracted_data is not None:
+        if draft["extracted_data"] is not None:
             st.success("✅ 逻辑验证通过！请核对结构化流水后归档（提交后不可修改）。")
+            if draft["ai_critique"] is None:
+                st.caption("🧠 技术总监点评生成中，可直接提交，点评完成后将自动补录到工单。")
             with st.form("ticket_form"):
                 st.markdown("### 📝 基础信息")
                 col1, col2 = st.columns(2)
-                device_sn = col1.text_input("设备 SN 号", value=st.session_state.extracted_data.get("device_sn", ""))
-                product_line = col2.text_input("产品线/机型", value=st.session_state.extracted_data.get("product_line", ""))
-                fault_type = col1.text_input("故障类型", value=st.session_state.extracted_data.get("fault_type", ""))
-                start_time = col2.text_input("维修开始时间", value=st.session_state.extracted_data.get("start_time", ""))
-                end_time = col1.text_input("维修结束时间", value=st.session_state.extracted_data.get("end_time", ""))
+                device_sn = col1.text_input("设备 SN 号", value=draft["extracted_data"].get("device_sn", ""))
+                product_line = col2.text_input("产品线/机型", value=draft["extracted_data"].get("product_line", ""))
+                fault_type = col1.text_input("故障类型", value=draft["extracted_data"].get("fault_type", ""))
+                start_time = col2.text_input("维修开始时间", value=draft["extracted_data"].get("start_time", ""))
+                end_time = col1.text_input("维修结束时间", value=draft["extracted_data"].get("end_time", ""))
                 
                 st.divider()
                 st.markdown("### 🔧 换件流水 (动态分离展示)")
-                reps = st.session_state.extracted_data.get("replacements", [])
+                reps = draft["extracted_data"].get("replacements", [])
                 if not reps:
                     reps = [{}] 
 
@@ -180,29 +324,37 @@ if role == "👨‍🔧 一线工程师 (FE)":
                 
                 if submit_btn:
                     reps_json = json.dumps(final_reps_data, ensure_ascii=False)
-                    conn = sqlite3.connect('tickets.db')
-                    c = conn.cursor()
-                    c.execute('''
-                        INSERT INTO tickets (engineer_name, device_sn, product_line, fault_type, start_time, end_time, replacements, final_report, ai_critique, created_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (engineer_name, device_sn, product_line, fault_type, start_time, end_time, reps_json, st.session_state.final_report, st.session_state.ai_critique, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-                    conn.commit()
-                    conn.close()
-                    
+                    ticket_id = db.insert_ticket(
+                        engineer_name, device_sn, product_line, fault_type, start_time, end_time,
+                        reps_json, draft["final_report"], draft["ai_critique"],
+                    )
+
+                    if draft["extraction_failed"]:
+                        jobs.enqueue(ticket_id, jobs.JOB_EXTRACTION, draft["messages"])
+                    if draft["ai_critique"] is None:
+                        # 点评还没回来：先落一个持久任务兜底，应用内线程先算完就直接完成它
+                        if critique_future.done():
+                            jobs.enqueue(ticket_id, jobs.JOB_CRITIQUE, draft["messages"])
+                        else:
+                            job_id = jobs.enqueue(ticket_id, jobs.JOB_CRITIQUE, draft["messages"], delay=IN_APP_CRITIQUE_GRACE)
+                            critique_future.add_done_callback(
+                                lambda fut, jid=job_id, tid=ticket_id: save_late_critique(jid, tid, fut)
+                            )
+
                     st.toast("工单已锁定并归档！", icon="🔒")
-                    del st.session_state.messages
-                    del st.session_state.display_messages
-                    del st.session_state.is_done
-                    del st.session_state.extracted_data
-                    del st.session_state.ai_critique
+                    drafts.close(draft["id"], "submitted", ticket_id)
+                    st.session_state.draft_id = None
+                    # 新工单要出现在历史里，这里整页重跑
                     st.rerun()
 
-    with tab_history:
-        conn = sqlite3.connect('tickets.db')
-        c = conn.cursor()
-        c.execute('SELECT id, device_sn, fault_type, created_at, final_report, replacements FROM tickets WHERE engineer_name = ? ORDER BY id DESC', (engineer_name,))
-        history_rows = c.fetchall()
-        conn.close()
+    @st.fragment
+    @metrics.timed("rerun.history")
+    def render_history(engineer_name):
+        history_key = f"history_{engineer_name}"
+        with metrics.timer("db.history"):
+            history_rows = db.list_engineer_tickets(engineer_name, keyset_page_cursor(history_key))
+        history_has_more = len(history_rows) > db.PAGE_SIZE
+        history_rows = history_rows[:db.PAGE_SIZE]
         
         if not history_rows:
             st.info("您还没有提交过历史工单。")
@@ -222,18 +374,46 @@ if role == "👨‍🔧 一线工程师 (FE)":
                     if reps_list:
                         st.markdown("**换件流水：**")
                         st.table(reps_list) 
+            render_keyset_pager(history_key, history_rows, history_has_more)
+
+    tab_work, tab_history = st.tabs(["💬 当前工单处理", "🗂️ 我的历史工单 (只读)"])
+    with tab_work:
+        render_chat(engineer_name)
+    with tab_history:
+        render_history(engineer_name)
 
 # =====================================================================
 #                          👔 交付总监/PM 视图 (Dashboard View)
 # =====================================================================
 elif role == "👔 交付总监/PM":
 
+    CRITIQUE_STATUS_LABELS = {"pending": "⏳ 排队中", "running": "🔄 生成中", "failed": "❌ 生成失败"}
+
     @st.dialog("🎫 工单详细审计报告", width="large")
-    def show_ticket_dialog(t_id, t_name, t_sn, t_fault, t_time, t_critique, t_report, t_reps):
+    def show_ticket_dialog(t_id, t_job_status=None):
+        # 大字段只在打开详情时按主键读取
+        _, t_name, t_sn, t_fault, t_time, t_critique, t_report, t_reps = db.get_ticket(t_id)
         st.subheader(f"工单 #{t_id} | 责任人: {t_name}")
         st.caption(f"设备SN: {t_sn} | 故障类型: {t_fault} | 提交时间: {t_time}")
         
-        st.warning(f"**🧠 AI 技术总监审计点评：**\n\n{t_critique}")
+        if t_job_status in ("pending", "running"):
+            st.info(f"🧠 AI 技术总监点评{CRITIQUE_STATUS_LABELS[t_job_status]}，请稍后刷新查看。")
+        elif t_job_status == "failed":
+            st.error("🧠 AI 技术总监点评多次重试后仍生成失败，可重新发起点评。")
+        if t_critique is not None:
+            st.warning(f"**🧠 AI 技术总监审计点评：**\n\n{t_critique}")
+        elif t_job_status is None:
+            st.info("🧠 AI 技术总监点评仍在生成中，请稍后刷新查看。")
+
+        if t_job_status not in ("pending", "running") and t_report:
+            if st.button("🔁 重新生成点评", key=f"recritique_{t_id}"):
+                # 历史工单没有保存完整对话，以最终报告作为复盘上下文
+                recritique_msgs = [
+                    {"role": "system", "content": AGENT_SYSTEM_PROMPT},
+                    {"role": "assistant", "content": t_report},
+                ]
+                jobs.enqueue(t_id, jobs.JOB_RECRITIQUE, recritique_msgs)
+                st.success("已加入后台点评队列，完成后将自动更新。")
         
         tab1, tab2 = st.tabs(["📝 结构化换件流水", "📄 原始闭环报告"])
         with tab1:
@@ -254,48 +434,199 @@ elif role == "👔 交付总监/PM":
     st.title("📊 全局交付审计与技术总监看板")
     st.caption("全局视野：掌控工单流转，快速审核 AI 专家提供的交付动作复盘。")
     
-    conn = sqlite3.connect('tickets.db')
-    c = conn.cursor()
-    c.execute('SELECT id, engineer_name, device_sn, fault_type, created_at, ai_critique, final_report, replacements FROM tickets ORDER BY id DESC')
-    rows = c.fetchall()
-    conn.close()
-
-    if not rows:
-        st.info("当前工单库为空，等待工程师提交。")
-    else:
-        total_tickets = len(rows)
-        replaced_count = 0
-        for r in rows:
-            try:
-                reps = json.loads(r[7])
-                if reps and len(reps) > 0 and "更换时间" in reps[0]: 
-                    replaced_count += 1
-            except:
-                pass
-
-        col1, col2, col3 = st.columns(3)
-        col1.metric(label="今日工单总数", value=total_tickets)
-        col2.metric(label="涉及换件单数", value=replaced_count)
-        col3.metric(label="智能审计覆盖率", value="100%")
-        
+    # 看板、检索、溯源各自是独立的 fragment，翻页/选中/检索只重跑所在的一块
+    @st.fragment
+    @metrics.timed("rerun.dashboard")
+    def render_dashboard():
+        page_cursor = keyset_page_cursor("dashboard")
+        with metrics.timer("db.dashboard_list"):
+            rows = db.list_tickets(page_cursor)
+            critique_jobs = jobs.open_critique_jobs()
+        has_more = len(rows) > db.PAGE_SIZE
+        rows = rows[:db.PAGE_SIZE]
+
+        if not rows:
+            st.info("当前工单库为空，等待工程师提交。")
+            return
+
+        with metrics.timer("db.dashboard_stats"):
+            today_tickets, today_replaced, _ = db.stats_for_day()
+            total_tickets, _, _ = db.stats_totals()
+
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric(label="今日工单总数", value=today_tickets)
+        col2.metric(label="今日涉及换件单数", value=today_replaced)
+        col3.metric(label="累计工单总数", value=total_tickets)
+        col4.metric(label="智能审计覆盖率", value="100%")
+
+        with st.expander("📈 近 30 天交付趋势", expanded=False):
+            with metrics.timer("db.dashboard_trend"):
+                trend = db.daily_trend(30)
+                breakdowns = {dimension: db.stats_breakdown(dimension, 30) for dimension in ("fault_type", "product_line")}
+            st.line_chart(
+                {"日期": [r[0] for r in trend], "工单数": [r[1] for r in trend], "涉及换件单数": [r[2] for r in trend]},
+                x="日期", y=["工单数", "涉及换件单数"],
+            )
+            tc1, tc2 = st.columns(2)
+            for col, dimension, title in ((tc1, "fault_type", "按故障类型"), (tc2, "product_line", "按产品线")):
+                breakdown = breakdowns[dimension]
+                col.markdown(f"**{title}**")
+                col.bar_chart(
+                    {title: [r[0] or "未填写" for r in breakdown], "工单数": [r[1] for r in breakdown], "换件数": [r[2] for r in breakdown]},
+                    x=title, y=["工单数", "换件数"],
+                )
+
+        queued = sorted(t for t, status in critique_jobs.items() if status in ("pending", "running"))
+        if queued:
+            st.info(f"🧠 以下工单的技术总监点评仍在后台生成：{', '.join(f'#{t}' for t in queued)}")
+    
         st.divider()
         st.markdown("### 📋 工单数据流转中心")
+        st.caption("点击任意一行查看工单详情。")
 
-        hc1, hc2, hc3, hc4, hc5 = st.columns([1, 2, 2, 3, 2])
-        hc1.write("**工单ID**")
-        hc2.write("**责任人**")
-        hc3.write("**故障类型**")
-        hc4.write("**提交时间**")
-        hc5.write("**操作**")
-        st.markdown("---")
-        
-        for row in rows:
-            t_id, t_name, t_sn, t_fault, t_time, t_critique, t_report, t_reps = row
-            c1, c2, c3, c4, c5 = st.columns([1, 2, 2, 3, 2])
-            c1.write(f"#{t_id}")
-            c2.write(t_name)
-            c3.write(t_fault)
-            c4.write(t_time)
-            
-            if c5.button("查看详情", key=f"btn_{t_id}"):
-                show_ticket_dialog(t_id, t_name, t_sn, t_fault, t_time, t_critique, t_report, t_reps)
+        # 整页只有一个表格组件，选中行触发 fragment 重跑；key 带上页游标，翻页后选中状态自动清空
+        grid_nonce = st.session_state.setdefault("dashboard_grid_nonce", 0)
+        event = st.dataframe(
+            [{
+                "工单ID": f"#{t_id}",
+                "责任人": t_name,
+                "故障类型": t_fault,
+                "提交时间": t_time,
+                "点评状态": CRITIQUE_STATUS_LABELS.get(critique_jobs.get(t_id), "✅ 已完成" if t_has_critique else "⏳ 生成中"),
+            } for t_id, t_name, t_sn, t_fault, t_time, t_has_critique in rows],
+            key=f"dashboard_grid_{page_cursor}_{grid_nonce}",
+            on_select="rerun", selection_mode="single-row",
+            hide_index=True, use_container_width=True,
+        )
+        selected = event.selection.rows
+        if selected:
+            # 选中后换一个 key 立即重跑，表格回到未选中状态再弹出详情：关掉弹窗后再点同一行照样会打开
+            st.session_state.dashboard_grid_nonce = grid_nonce + 1
+            st.session_state.dashboard_open_ticket = rows[selected[0]][0]
+            rerun_fragment()
+        open_ticket = st.session_state.pop("dashboard_open_ticket", None)
+        if open_ticket is not None:
+            show_ticket_dialog(open_ticket, critique_jobs.get(open_ticket))
+
+        render_keyset_pager("dashboard", rows, has_more)
+
+    @st.fragment
+    @metrics.timed("rerun.search")
+    def render_search():
+        search_text = st.text_input("按故障现象检索历史报告与 AI 点评：", placeholder="例如 NVLink 漏液（空格分隔多个关键词，英文词可用 * 前缀匹配）").strip()
+        if st.session_state.get("search_text") != search_text:
+            st.session_state.search_text = search_text
+            st.session_state.search_page = 0
+        if search_text:
+            critique_jobs = jobs.open_critique_jobs()
+            search_page = st.session_state.search_page
+            started = time.perf_counter()
+            hits = db.search_tickets(search_text, search_page)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            metrics.record("db.search", elapsed_ms)
+            st.caption(f"第 {search_page + 1} 页 · 查询耗时 {elapsed_ms:.1f} ms")
+
+            if not hits:
+                st.info("没有匹配的工单。")
+            for h_id, h_name, h_sn, h_fault, h_time, report_snip, critique_snip in hits[:db.PAGE_SIZE]:
+                with st.container(border=True):
+                    sc1, sc2 = st.columns([5, 1])
+                    sc1.markdown(f"**#{h_id}** | {h_name} | SN: {h_sn} | {h_fault} | {h_time}")
+                    if sc2.button("查看详情", key=f"search_btn_{h_id}"):
+                        show_ticket_dialog(h_id, critique_jobs.get(h_id))
+                    # 未命中的字段 snippet 会退化为开头一段原文，只展示带高亮的摘要
+                    if db.HIGHLIGHT_OPEN in report_snip:
+                        st.markdown(f"📄 {report_snip}")
+                    if db.HIGHLIGHT_OPEN in critique_snip:
+                        st.markdown(f"🧠 {critique_snip}")
+
+            sp1, _, sp3 = st.columns([1, 2, 1])
+            if sp1.button("⬅️ 上一页", key="search_prev", disabled=search_page == 0):
+                st.session_state.search_page -= 1
+                rerun_fragment()
+            if sp3.button("下一页 ➡️", key="search_next", disabled=len(hits) <= db.PAGE_SIZE):
+                st.session_state.search_page += 1
+                rerun_fragment()
+
+    @st.fragment
+    @metrics.timed("rerun.lookup")
+    def render_lookup():
+        lookup_key = st.text_input("输入部件 QN 或设备 SN：", placeholder="例如 QN 码或整机 SN").strip()
+        if lookup_key:
+            started = time.perf_counter()
+            part_rows = db.find_parts_by_qn(lookup_key)
+            sn_rows = db.find_tickets_by_sn(lookup_key)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            metrics.record("db.lookup", elapsed_ms)
+            st.caption(f"查询耗时 {elapsed_ms:.1f} ms")
+
+            if part_rows:
+                st.markdown(f"**🔧 涉及该 QN 的换件记录（{len(part_rows)} 条）**")
+                st.dataframe(
+                    [dict(zip(["工单ID", "序号", "提交时间", "责任人", "设备SN", "产品线", "更换时间", "换上件类型", "换上件QN", "换下件类型", "换下件QN"], r)) for r in part_rows],
+                    hide_index=True, use_container_width=True,
+                )
+            if sn_rows:
+                st.markdown(f"**🖥️ 该设备的工单（最近 {len(sn_rows)} 张）**")
+                st.dataframe(
+                    [dict(zip(["工单ID", "责任人", "故障类型", "产品线", "提交时间"], r)) for r in sn_rows],
+                    hide_index=True, use_container_width=True,
+                )
+            if not part_rows and not sn_rows:
+                st.info("未找到匹配的换件记录或工单。")
+
+        st.divider()
+        st.markdown("### 📦 备件消耗统计")
+        # 放进表单、点了才查：st.tabs 每次整页重跑都会执行所有标签页，不能让统计查询跟着每次 rerun
+        with st.form("consumption_form", border=False):
+            lc1, lc2 = st.columns(2)
+            line_choice = lc1.selectbox("产品线", ["全部"] + db.product_lines())
+            since = lc2.date_input("统计起始日期", value=date.today().replace(day=1))
+            if st.form_submit_button("📊 统计"):
+                with metrics.timer("db.part_consumption"):
+                    st.session_state.consumption = (
+                        line_choice, since, db.part_consumption(since.isoformat(), None if line_choice == "全部" else line_choice)
+                    )
+        if "consumption" in st.session_state:
+            c_line, c_since, consumption = st.session_state.consumption
+            st.caption(f"产品线：{c_line} · 自 {c_since.isoformat()} 起")
+            if consumption:
+                st.dataframe([{"换上件类型": t, "数量": n} for t, n in consumption], hide_index=True, use_container_width=True)
+            else:
+                st.info("该范围内没有换件记录。")
+
+    @st.fragment
+    def render_metrics():
+        # 与备件消耗统计一样放进表单、点了才算，埋点汇总不跟着每次整页 rerun
+        with st.form("metrics_form", border=False):
+            window = st.selectbox("统计窗口", [1, 24, 168], index=1, format_func=lambda h: f"最近 {h} 小时")
+            if st.form_submit_button("📊 统计"):
+                st.session_state.metrics_summary = (window, metrics.summary(window))
+        if "metrics_summary" not in st.session_state:
+            return
+        window, rows = st.session_state.metrics_summary
+        st.caption(f"统计窗口：最近 {window} 小时")
+        if not rows:
+            st.info("该时间窗口内还没有埋点数据。")
+            return
+        st.caption("rerun.* 为整页/各区块重跑耗时，db.* 为看板与历史查询，llm.* 含调度排队在内的模型调用，closure.e2e 为工程师发出闭环回复到表单可填写的总耗时。")
+        st.dataframe(
+            [{
+                "指标": name, "次数": count, "p50 (ms)": round(p50, 1), "p95 (ms)": round(p95, 1),
+                "平均输入 tokens": round(prompt_tokens) if prompt_tokens is not None else None,
+                "平均输出 tokens": round(completion_tokens) if completion_tokens is not None else None,
+            } for name, count, p50, p95, prompt_tokens, completion_tokens in rows],
+            hide_index=True, use_container_width=True,
+        )
+
+    tab_board, tab_search, tab_lookup, tab_metrics = st.tabs(["📋 工单看板", "🔍 全文检索", "🔎 QN / SN 溯源", "⏱️ 性能指标"])
+    with tab_board:
+        render_dashboard()
+    with tab_search:
+        render_search()
+    with tab_lookup:
+        render_lookup()
+    with tab_metrics:
+        render_metrics()
+
+metrics.record("rerun.app", (time.perf_counter() - rerun_started) * 1000)
@@ -0,0 +1,113 @@
+"""
+合成工单生成器：按真实写入路径的表结构批量灌入 tickets / replacements / stats_rollups（FTS 由触发器同步），用于 1 万 ~ 100 万行规模的压测。
+
+    python bench/gen_tickets.py --rows 100000 --db /tmp/bench/tickets.db
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+
+BATCH_SIZE = 5000
+FAULT_TYPES = ["GPU 掉卡", "NVLink 报错", "内存 ECC", "液冷漏液", "电源故障", "主板故障", "硬盘故障", "网卡故障"]
+PRODUCT_LINES = ["H100", "H800", "A800", "L40S", "B200"]
+PART_TYPES = {
+    "GPU 掉卡": "GPU 模组", "NVLink 报错": "NVLink 桥接板", "内存 ECC": "DDR5 内存条", "液冷漏液": "冷板组件",
+    "电源故障": "PSU 电源", "主板故障": "主板", "硬盘故障": "NVMe SSD", "网卡故障": "IB 网卡",
+}
+
+
+def engineer_names(count):
+    return [f"工程师{i:03d}" for i in range(1, count + 1)]
+
+def fake_ticket(rng, ticket_id, created, engineers):
+    fault = rng.choice(FAULT_TYPES)
+    line = rng.choice(PRODUCT_LINES)
+    sn = f"SN{line}{ticket_id:09d}"
+    part = PART_TYPES[fault]
+    reps = []
+    # 约四成工单有换件，每单 1~3 行
+    if rng.random() < 0.4:
+        for seq in range(rng.randint(1, 3)):
+            replace_time = (created - timedelta(minutes=30 * (seq + 1))).strftime("%Y-%m-%d %H:%M")
+            reps.append({
+                "更换时间": replace_time, "更换信息": f"更换{part}，复测通过",
+                "换上件类型": part, "换上件QN": f"QN{ticket_id:09d}N{seq}",
+                "换下件类型": part, "换下件QN": f"QN{ticket_id:09d}O{seq}",
+            })
+    report = (
+        f"### 📄 最终交付报告\n\n**设备**：{line} 整机，{sn}\n\n**现象**：{fault}，业务中断。\n\n"
+        f"**排查**：交叉验证定位到{part}，排除供电与线缆因素。\n\n"
+        f"**处理**：{'已更换' + part if reps else '重新插拔固定后恢复'}，压测无复现。"
+    )
+    critique = f"**技术总监点评**：{fault}排查路径完整，建议补充{part}的固件版本记录。" if rng.random() < 0.9 else None
+    created_at = created.strftime("%Y-%m-%d %H:%M:%S")
+    ticket = (
+        ticket_id, rng.choice(engineers), sn, line, fault,
+        (created - timedelta(hours=2)).strftime("%Y-%m-%d %H:%M"), created.strftime("%Y-%m-%d %H:%M"),
+        json.dumps(reps, ensure_ascii=False), report, critique, created_at,
+    )
+    rep_rows = [
+        (ticket_id, seq, *(rep[zh] for zh in db.REPLACEMENT_KEYS.values()))
+        for seq, rep in enumerate(reps, start=1)
+    ]
+    return ticket, rep_rows, (created_at[:10], ticket[1], fault, line, len(reps))
+
+def generate(rows, days=90, engineers=200, seed=42, progress=True):
+    """追加 rows 张工单，created_at 在最近 days 天内随 id 递增；返回耗时（秒）。"""
+    rng = random.Random(seed)
+    names = engineer_names(engineers)
+    start_id = (db.query_one('SELECT COALESCE(MAX(id), 0) FROM tickets')[0]) + 1
+    now = datetime.now()
+    step = timedelta(days=days) / max(rows, 1)
+    started = time.perf_counter()
+
+    for batch_start in range(0, rows, BATCH_SIZE):
+        tickets, rep_rows, stats = [], [], []
+        for offset in range(batch_start, min(rows, batch_start + BATCH_SIZE)):
+            ticket, reps, stat = fake_ticket(rng, start_id + offset, now - timedelta(days=days) + step * offset, names)
+            tickets.append(ticket)
+            rep_rows.extend(reps)
+            stats.append(stat)
+        with db.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO tickets (id, engineer_name, device_sn, product_line, fault_type, start_time, end_time, replacements, final_report, ai_critique, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', tickets)
+            conn.executemany('''
+                INSERT INTO replacements (ticket_id, seq, replace_time, action_info, new_type, new_qn, old_type, old_qn)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rep_rows)
+            for day, engineer_name, fault_type, product_line, parts in stats:
+                db._bump_ticket_stats(conn, day, engineer_name, fault_type, product_line, 1, parts)
+        if progress:
+            done = min(rows, batch_start + BATCH_SIZE)
+            print(f"\r{done}/{rows} tickets ({time.perf_counter() - started:.1f}s)", end="", flush=True)
+    if progress:
+        print()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成工单数据")
+    parser.add_argument("--rows", type=int, default=10000, help="追加的工单数（1 万 ~ 100 万）")
+    parser.add_argument("--db", default=db.DB_PATH, help="工单库路径")
+    parser.add_argument("--days", type=int, default=90, help="created_at 分布的天数")
+    parser.add_argument("--engineers", type=int, default=200, help="责任人数量")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    db.DB_PATH = args.db
+    elapsed = generate(args.rows, args.days, args.engineers, args.seed)
+    print(f"inserted {args.rows} tickets into {args.db} in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+离线压测用的 OpenAI 兼容桩服务：只实现 POST /v1/chat/completions（含 stream），按请求内容返回 Agent 追问 / 闭环报告 / 提取 JSON / 点评。
+
+    python bench/mock_server.py --port 8765 --ttft 0.4 --token-delay 0.02
+    MOONSHOT_BASE_URL=http://127.0.0.1:8765/v1 MOONSHOT_API_KEY=x streamlit run agent_app.py
+
+工程师消息里带“结单”即返回闭环报告（含 <EXTRACTION_JSON> 附录），否则返回一条追问。
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extraction import EXTRACTION_CLOSE, EXTRACTION_OPEN
+from prompts import CONTEXT_SUMMARY_PROMPT, CRITIQUE_PROMPT, EXTRACTION_REPAIR_PROMPT, JSON_EXTRACTION_PROMPT
+
+CLOSE_TRIGGER = "结单"
+
+EXTRACTION = {
+    "device_sn": "SN2024BENCH0001",
+    "product_line": "H100",
+    "fault_type": "GPU 掉卡",
+    "start_time": "2024-05-01 09:00",
+    "end_time": "2024-05-01 11:30",
+    "replacements": [{
+        "replace_time": "2024-05-01 10:15",
+        "action_info": "更换 GPU 模组，复测 24 小时无掉卡",
+        "new_type": "GPU 模组", "new_qn": "QNNEW000001",
+        "old_type": "GPU 模组", "old_qn": "QNOLD000001",
+    }],
+}
+
+FOLLOW_UP = "[打回追问] 请补充：掉卡前的 dmesg / XID 报错码、换件前后的交叉验证结果，以及换下件的 QN 码。"
+
+FINAL_REPORT = (
+    "<FINAL_REPORT>\n"
+    "**设备**：H100 整机，SN2024BENCH0001\n\n"
+    "**现象**：业务运行中 GPU 掉卡，dmesg 出现 XID 79。\n\n"
+    "**排查**：交叉互换槽位后故障跟随 GPU 模组，排除主板与供电问题。\n\n"
+    "**处理**：10:15 更换 GPU 模组（QNOLD000001 → QNNEW000001），压测 24 小时无复现。\n"
+)
+
+CRITIQUE = (
+    "**技术总监点评**：排查路径完整，交叉验证有效定位到 GPU 模组。"
+    "建议补充换件前的固件版本与温度曲线，便于后续同批次问题复盘。"
+)
+
+SUMMARY = "【前情摘要】工程师报告 H100 整机 GPU 掉卡，已提供 XID 报错，正在补充交叉验证结果。"
+
+
+def pick_reply(messages):
+    last = messages[-1]["content"] if messages else ""
+    if last == JSON_EXTRACTION_PROMPT:
+        return json.dumps(EXTRACTION, ensure_ascii=False)
+    if last == CRITIQUE_PROMPT:
+        return CRITIQUE
+    if messages and messages[0]["content"] == EXTRACTION_REPAIR_PROMPT:
+        return json.dumps(EXTRACTION, ensure_ascii=False)
+    if messages and messages[0]["content"] == CONTEXT_SUMMARY_PROMPT:
+        return SUMMARY
+    if CLOSE_TRIGGER in last:
+        return f"{FINAL_REPORT}\n{EXTRACTION_OPEN}\n{json.dumps(EXTRACTION, ensure_ascii=False)}\n{EXTRACTION_CLOSE}"
+    return FOLLOW_UP
+
+
+def make_handler(args):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *a):
+            pass
+
+        def _json(self, status, body, headers=None):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._json(404, {"error": {"message": "not found"}})
+                return
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if random.random() < args.error_rate:
+                self._json(429, {"error": {"message": "rate limited (mock)", "type": "rate_limit"}}, {"Retry-After": "1"})
+                return
+
+            messages = req.get("messages", [])
+            model = req.get("model", "moonshot-v1-8k")
+            reply = pick_reply(messages)
+            chunks = [reply[i:i + args.chunk_chars] for i in range(0, len(reply), args.chunk_chars)] or [""]
+            usage = {
+                "prompt_tokens": sum(len(m.get("content") or "") for m in messages) // 2,
+                "completion_tokens": len(reply) // 2,
+            }
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+            time.sleep(args.ttft)
+
+            if not req.get("stream"):
+                time.sleep(args.token_delay * (len(chunks) - 1))
+                self._json(200, {
+                    "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+
+            def send(payload):
+                self.wfile.write(f"data: {payload}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            for i, piece in enumerate(chunks):
+                if i:
+                    time.sleep(args.token_delay)
+                send(json.dumps({
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": {"role": "assistant", "content": piece}, "finish_reason": None}],
+                }, ensure_ascii=False))
+            # 与标准 OpenAI 一致：最后一个分片 choices 为空，usage 挂在 chunk 上
+            send(json.dumps({
+                "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [], "usage": usage,
+            }))
+            send("[DONE]")
+            self.close_connection = True
+
+    return Handler
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的本地桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft", type=float, default=0.3, help="首个分片前的延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="相邻分片之间的延迟（秒）")
+    parser.add_argument("--chunk-chars", type=int, default=4, help="每个流式分片的字符数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="按该比例返回 429（带 Retry-After）")
+    return parser
+
+
+def serve(args):
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args))
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    serve(build_parser().parse_args())
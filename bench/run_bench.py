@@ -0,0 +1,185 @@
+"""
+离线压测：起一个本地桩服务，用 Streamlit AppTest 脚本化地跑工程师（多轮对话 → 闭环 → 提交）与 PM（看板翻页 → 查看详情 → 检索 → 溯源）会话，
+汇报每次交互的 rerun 墙钟时间，以及应用内埋点（metrics 表）里的查询 / LLM / 闭环端到端 p50、p95。
+
+    python bench/run_bench.py --rows 100000 --fe-sessions 5 --pm-sessions 5
+    python bench/run_bench.py --workdir /tmp/bench --rows 0     # 复用已生成的库
+
+所有文件（tickets.db、llm_cache.db）都落在 --workdir，不会碰到仓库目录下的数据。
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+APP_PATH = os.path.join(REPO_DIR, "agent_app.py")
+sys.path.insert(0, REPO_DIR)
+
+PM_ROLE = "👔 交付总监/PM"
+FE_TURNS = [
+    "H100 整机业务中 GPU 掉卡，dmesg 有 XID 79。",
+    "交叉互换槽位后故障跟随 GPU 模组，换下件 QN 为 QNOLD000001。",
+]
+FE_CLOSING = "换上 QNNEW000001 后压测 24 小时无复现，请结单。"
+
+
+# ================= 1. 桩服务 =================
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_mock(args):
+    port = args.port or free_port()
+    proc = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "mock_server.py"), "--port", str(port),
+        "--ttft", str(args.ttft), "--token-delay", str(args.token_delay), "--error-rate", str(args.error_rate),
+    ])
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc, f"http://127.0.0.1:{port}/v1"
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("mock server did not start")
+
+# ================= 2. 脚本化会话 =================
+class Session:
+    """包一层 AppTest，记录每次交互（含其触发的 st.rerun）的墙钟时间。"""
+
+    def __init__(self, timings):
+        from streamlit.testing.v1 import AppTest
+        self.at = AppTest.from_file(APP_PATH, default_timeout=120)
+        self.at.secrets["MOONSHOT_API_KEY"] = "bench"
+        self.timings = timings
+
+    def step(self, name, action=None):
+        started = time.perf_counter()
+        (action or self.at).run()
+        self.timings.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+        if self.at.exception:
+            raise RuntimeError(f"{name}: {self.at.exception[0].value}")
+        return self.at
+
+    def button(self, text):
+        return next(b for b in self.at.button if text in b.label)
+
+    def text_input(self, label_prefix):
+        return next(t for t in self.at.text_input if t.label.startswith(label_prefix))
+
+def fe_session(timings, engineer_name):
+    s = Session(timings)
+    s.step("fe.load")
+    s.step("fe.set_engineer", s.text_input("请输入您的姓名").set_value(engineer_name))
+    for turn in FE_TURNS:
+        s.step("fe.chat_turn", s.at.chat_input[0].set_value(turn))
+    # 闭环这一轮：流式回复 + 提取（附录合法时不再请求），表单就绪
+    s.step("fe.closing_turn", s.at.chat_input[0].set_value(FE_CLOSING))
+    s.step("fe.submit", s.button("提交至工单库").click())
+
+def pm_session(timings, pages, search_text, lookup_key):
+    s = Session(timings)
+    s.step("pm.load")
+    s.step("pm.switch_role", s.at.sidebar.selectbox[0].select(PM_ROLE))
+    for _ in range(pages):
+        s.step("pm.next_page", s.at.button(key="dashboard_next").click())
+    # AppTest 没有表格选中的接口，直接写入选中状态，等价于点击当前页第一行
+    cursor = s.at.session_state["dashboard_cursors"][-1]
+    nonce = s.at.session_state["dashboard_grid_nonce"]
+    s.at.session_state[f"dashboard_grid_{cursor}_{nonce}"] = {"selection": {"rows": [0], "columns": []}}
+    s.step("pm.open_ticket")
+    s.step("pm.search", s.text_input("按故障现象检索").set_value(search_text))
+    s.step("pm.lookup", s.text_input("输入部件 QN").set_value(lookup_key))
+
+# ================= 3. 汇报 =================
+def summarize(values):
+    import metrics
+    ordered = sorted(values)
+    return len(ordered), metrics.percentile(ordered, 0.5), metrics.percentile(ordered, 0.95), ordered[-1]
+
+def print_table(title, rows, headers):
+    print(f"\n== {title} ==")
+    widths = [max(len(str(h)), *(len(str(r[i])) for r in rows)) for i, h in enumerate(headers)]
+    print("  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    for r in rows:
+        print("  ".join(str(v).ljust(w) for v, w in zip(r, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PIA 离线压测")
+    parser.add_argument("--workdir", help="tickets.db 等文件所在目录，默认新建临时目录")
+    parser.add_argument("--rows", type=int, default=10000, help="压测前追加的合成工单数，0 表示不生成")
+    parser.add_argument("--fe-sessions", type=int, default=3)
+    parser.add_argument("--pm-sessions", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=5, help="每个 PM 会话向后翻的页数")
+    parser.add_argument("--port", type=int, help="桩服务端口，默认随机")
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="另存一份 JSON 结果")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pia-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    mock, base_url = start_mock(args)
+    # llm.py 在导入时读取该变量，必须在 AppTest 首次执行脚本之前设置
+    os.environ["MOONSHOT_BASE_URL"] = base_url
+    # 先占住 root logger，agent_app.py 里的 basicConfig(INFO) 就不会把每次请求都打出来
+    logging.basicConfig(level=logging.WARNING)
+
+    try:
+        import db
+        import metrics
+        from gen_tickets import engineer_names, generate
+
+        if args.rows:
+            print(f"generating {args.rows} tickets in {workdir} ...")
+            generate(args.rows)
+        total_rows = db.query_one('SELECT COUNT(*) FROM tickets')[0]
+        db.execute('DELETE FROM metrics')
+
+        timings = {}
+        started = time.perf_counter()
+        names = engineer_names(200)
+        for i in range(args.fe_sessions):
+            fe_session(timings, names[i % len(names)])
+        for i in range(args.pm_sessions):
+            pm_session(timings, args.pages, "GPU 掉卡", f"QN{(i + 1) * 7:09d}N0")
+        elapsed = time.perf_counter() - started
+        # 点评在线程池里异步完成，留一点时间让它们的埋点落库
+        time.sleep(args.ttft + 1)
+
+        interactions = [(name, *(round(v, 1) if isinstance(v, float) else v for v in summarize(values)))
+                        for name, values in timings.items()]
+        instrumented = [(name, count, round(p50, 1), round(p95, 1),
+                         round(pt) if pt is not None else "", round(ct) if ct is not None else "")
+                        for name, count, p50, p95, pt, ct in metrics.summary(hours=1)]
+
+        print(f"\nworkdir={workdir} tickets={total_rows} fe_sessions={args.fe_sessions} pm_sessions={args.pm_sessions} "
+              f"ttft={args.ttft}s token_delay={args.token_delay}s wall={elapsed:.1f}s")
+        print_table("交互墙钟时间（AppTest，含触发的 rerun）", interactions, ["interaction", "n", "p50 ms", "p95 ms", "max ms"])
+        print_table("应用内埋点（metrics 表）", instrumented, ["metric", "n", "p50 ms", "p95 ms", "avg prompt tok", "avg completion tok"])
+
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({
+                    "tickets": total_rows, "wall_seconds": elapsed,
+                    "interactions": {r[0]: dict(zip(["n", "p50_ms", "p95_ms", "max_ms"], r[1:])) for r in interactions},
+                    "metrics": {r[0]: dict(zip(["n", "p50_ms", "p95_ms", "avg_prompt_tokens", "avg_completion_tokens"], r[1:])) for r in instrumented},
+                }, f, ensure_ascii=False, indent=2)
+    finally:
+        mock.terminate()
+
+
+if __name__ == "__main__":
+    main()
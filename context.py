@@ -0,0 +1,111 @@
+"""
+长对话的 token 预算管理：估算每条消息的 token 数，超预算时把较早的轮次压成前情摘要，
+并按实际需要挑选上下文窗口足够的模型档位。
+"""
+import logging
+import math
+import re
+
+from prompts import CONTEXT_SUMMARY_PROMPT
+
+log = logging.getLogger("llm")
+
+# 由小到大排列，只有放不下时才升档
+MODEL_TIERS = [
+    ("moonshot-v1-8k", 8192),
+    ("moonshot-v1-32k", 32768),
+    ("moonshot-v1-128k", 131072),
+]
+COMPLETION_RESERVE = 2048       # 给回复预留的 token
+COMPACT_TRIGGER_TOKENS = 5000   # 对话超过该值就压缩，保证 8k 档还能放下提取/点评 prompt
+KEEP_RECENT_MESSAGES = 6        # 最近的若干条消息始终原文保留
+MESSAGE_OVERHEAD_TOKENS = 4
+SUMMARY_MARKER = "【前情摘要】"
+
+_CJK_CHAR = re.compile(r"[\u3400-\u9fff\uf900-\ufaff\u3000-\u303f\uff00-\uffef]")
+# SN / QN / 报错码一类的编号：字母数字混排、至少 6 位，前后不能紧贴其他字母数字
+_IDENTIFIER = re.compile(r"(?<![A-Za-z0-9_-])(?=[A-Za-z0-9_-]*\d)(?=[A-Za-z0-9_-]*[A-Za-z])[A-Za-z0-9][A-Za-z0-9_-]{5,}(?![A-Za-z0-9_-])")
+
+
+# ================= 1. token 估算 =================
+def estimate_tokens(text):
+    """没有官方分词器时的保守估计：中文及全角符号约 1 字 1 token，其余约 4 字符 1 token。"""
+    if not text:
+        return 0
+    cjk = len(_CJK_CHAR.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+def count_message_tokens(message):
+    return estimate_tokens(message.get("content")) + MESSAGE_OVERHEAD_TOKENS
+
+def count_tokens(messages):
+    return sum(count_message_tokens(m) for m in messages)
+
+def pick_model(messages, completion_reserve=COMPLETION_RESERVE):
+    needed = count_tokens(messages) + completion_reserve
+    for model, window in MODEL_TIERS:
+        if needed <= window:
+            return model
+    return MODEL_TIERS[-1][0]
+
+def log_usage(call, model, messages, response=None, completion_text=None):
+    """记录单次调用的 prompt / completion token 数；接口没返回 usage（如部分流式响应）时退回估算值。"""
+    usage = getattr(response, "usage", None)
+    if usage is not None and not isinstance(usage, dict):
+        usage = {"prompt_tokens": getattr(usage, "prompt_tokens", None), "completion_tokens": getattr(usage, "completion_tokens", None)}
+    if usage and usage.get("prompt_tokens") is not None:
+        prompt_tokens, completion_tokens, source = usage["prompt_tokens"], usage.get("completion_tokens") or 0, "api"
+    else:
+        prompt_tokens, completion_tokens, source = count_tokens(messages), estimate_tokens(completion_text), "estimate"
+    log.info("%s model=%s prompt_tokens=%s completion_tokens=%s (%s)", call, model, prompt_tokens, completion_tokens, source)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+# ================= 2. 历史压缩 =================
+def extract_identifiers(messages):
+    seen = {}
+    for m in messages:
+        for ident in _IDENTIFIER.findall(m.get("content") or ""):
+            seen.setdefault(ident, None)
+    return list(seen)
+
+def _transcript(messages):
+    speakers = {"user": "工程师", "assistant": "Agent", "system": "系统"}
+    return "\n\n".join(f"{speakers.get(m['role'], m['role'])}：{m['content']}" for m in messages)
+
+def compact_messages(client, messages, trigger_tokens=COMPACT_TRIGGER_TOKENS, keep_recent=KEEP_RECENT_MESSAGES):
+    """
+    超出 trigger_tokens 时，把开头的系统提示之后、最近 keep_recent 条之前的轮次（含上一次摘要）
+    交给模型压成一条前情摘要，SN/QN 等编号另外原文附在摘要后面。未超预算或摘要失败时原样返回。
+    """
+    if count_tokens(messages) <= trigger_tokens:
+        return messages
+    head = messages[:1] if messages and messages[0]["role"] == "system" else []
+    body = messages[len(head):]
+    split = len(body) - keep_recent
+    # 保留区从工程师的发言开始，避免把一问一答拆开
+    while split > 0 and body[split]["role"] != "user":
+        split -= 1
+    if split <= 0:
+        return messages
+    older, recent = body[:split], body[split:]
+
+    summary_msgs = [
+        {"role": "system", "content": CONTEXT_SUMMARY_PROMPT},
+        {"role": "user", "content": _transcript(older)},
+    ]
+    model = pick_model(summary_msgs)
+    try:
+        res = client.chat.completions.create(model=model, messages=summary_msgs, temperature=0.1)
+    except Exception as e:
+        log.warning("context summary failed, sending full history: %s", e)
+        return messages
+    summary = res.choices[0].message.content.strip()
+    log_usage("summary", model, summary_msgs, res, summary)
+
+    identifiers = extract_identifiers(older)
+    content = f"{SUMMARY_MARKER}\n{summary}"
+    if identifiers:
+        content += f"\n\n【关键编号（原文保留）】{', '.join(identifiers)}"
+    log.info("compacted %s messages (%s tokens) into summary (%s tokens)",
+             len(older), count_tokens(older), estimate_tokens(content))
+    return head + [{"role": "system", "content": content}] + recent
@@ -0,0 +1,523 @@
+"""
+工单库统一访问层：进程级共享连接 + WAL + busy timeout，所有视图与后台任务都经由这里读写。
+
+Streamlit 每次 rerun 只重新执行 agent_app.py，被 import 的模块常驻 sys.modules，
+所以这里的模块级连接天然跨 rerun、跨会话复用；worker.py 进程同样各持一条。
+"""
+import json
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+DB_PATH = "tickets.db"
+BUSY_TIMEOUT_MS = 30000
+PAGE_SIZE = 20
+
+# 提取结果（英文键）→ 工单库换件流水（中文键），与工程师表单保持一致
+REPLACEMENT_KEYS = {
+    "replace_time": "更换时间",
+    "action_info": "更换信息",
+    "new_type": "换上件类型",
+    "new_qn": "换上件QN",
+    "old_type": "换下件类型",
+    "old_qn": "换下件QN",
+}
+
+# 全文检索分词：FTS5 自带的 unicode61 会把连续汉字当成一个词，trigram 又搜不到两个字的词（如“漏液”）。
+# 这里在入索引前给每个汉字两侧插入零宽空格并声明为分隔符，汉字按字切分、英文仍按词切分，
+# 查询时把词组拆成相邻字的短语匹配；展示前去掉零宽空格即可还原原文。
+FTS_SEPARATOR = "\u200b"
+_CJK_CHAR = re.compile(r"([\u3400-\u9fff\uf900-\ufaff])")
+
+def cjk_segment(text):
+    if text is None:
+        return None
+    return _CJK_CHAR.sub(FTS_SEPARATOR + r"\1" + FTS_SEPARATOR, text)
+
+# ================= 1. 表结构迁移（按 PRAGMA user_version 顺序执行一次） =================
+def _backfill_ticket_stats(conn):
+    # 一次性把存量工单折算进聚合表（迁移 11 再转成 stats_rollups），之后只在写入工单时增量维护
+    rows = conn.execute('''
+        SELECT created_at, engineer_name, fault_type, product_line, replacements FROM tickets
+    ''').fetchall()
+    conn.executemany('''
+        INSERT INTO ticket_stats (day, engineer_name, fault_type, product_line, tickets, replaced_tickets, replaced_parts)
+        VALUES (?, ?, ?, ?, 1, ?, ?)
+        ON CONFLICT (day, engineer_name, fault_type, product_line) DO UPDATE SET
+            tickets = tickets + 1,
+            replaced_tickets = replaced_tickets + excluded.replaced_tickets,
+            replaced_parts = replaced_parts + excluded.replaced_parts
+    ''', [
+        ((created_at or "")[:10], engineer_name or "", fault_type or "", product_line or "", 1 if parts else 0, parts)
+        for created_at, engineer_name, fault_type, product_line, replacements in rows
+        for parts in (count_replacements(parse_replacements(replacements)),)
+    ])
+
+def _create_stats_rollups(conn):
+    # ticket_stats 按四个维度的全组合计数，行数几乎与工单数同阶；改成每个维度各自按天汇总 + 一行总计，
+    # 看板读取的行数只与天数和各维度取值个数有关
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_rollups (
+            dimension TEXT NOT NULL,
+            day TEXT NOT NULL,
+            value TEXT NOT NULL,
+            tickets INTEGER NOT NULL DEFAULT 0,
+            replaced_tickets INTEGER NOT NULL DEFAULT 0,
+            replaced_parts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dimension, day, value)
+        ) WITHOUT ROWID
+    ''')
+    sums = "SUM(tickets), SUM(replaced_tickets), SUM(replaced_parts)"
+    conn.execute(f"INSERT INTO stats_rollups SELECT '{ROLLUP_DAY}', day, '', {sums} FROM ticket_stats GROUP BY day")
+    for dimension in STATS_DIMENSIONS:
+        conn.execute(f"INSERT INTO stats_rollups SELECT '{dimension}', day, {dimension}, {sums} FROM ticket_stats GROUP BY day, {dimension}")
+    conn.execute(f'''
+        INSERT INTO stats_rollups
+        SELECT '{ROLLUP_TOTAL}', '', '', COALESCE(SUM(tickets), 0), COALESCE(SUM(replaced_tickets), 0), COALESCE(SUM(replaced_parts), 0)
+        FROM ticket_stats
+    ''')
+    conn.execute("DROP TABLE ticket_stats")
+
+def _backfill_replacements(conn):
+    rows = conn.execute('SELECT id, replacements FROM tickets').fetchall()
+    for ticket_id, replacements in rows:
+        _write_replacement_rows(conn, ticket_id, parse_replacements(replacements))
+
+def _create_tickets_fts(conn):
+    # 触发器体内含分号，不能走按 ; 切分的 SQL 迁移
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS tickets_fts USING fts5(
+            final_report, ai_critique, tokenize = "unicode61 separators '{FTS_SEPARATOR}'"
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS tickets_fts_ai AFTER INSERT ON tickets BEGIN
+            INSERT INTO tickets_fts (rowid, final_report, ai_critique)
+            VALUES (new.id, cjk_segment(new.final_report), cjk_segment(new.ai_critique));
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS tickets_fts_au AFTER UPDATE OF final_report, ai_critique ON tickets BEGIN
+            DELETE FROM tickets_fts WHERE rowid = old.id;
+            INSERT INTO tickets_fts (rowid, final_report, ai_critique)
+            VALUES (new.id, cjk_segment(new.final_report), cjk_segment(new.ai_critique));
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS tickets_fts_ad AFTER DELETE ON tickets BEGIN
+            DELETE FROM tickets_fts WHERE rowid = old.id;
+        END
+    ''')
+    conn.execute('''
+        INSERT INTO tickets_fts (rowid, final_report, ai_critique)
+        SELECT id, cjk_segment(final_report), cjk_segment(ai_critique) FROM tickets
+        WHERE id NOT IN (SELECT rowid FROM tickets_fts)
+    ''')
+
+MIGRATIONS = [
+    # 1: 工单主表（IF NOT EXISTS 兼容迁移机制引入之前建好的库）
+    '''
+    CREATE TABLE IF NOT EXISTS tickets (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        engineer_name TEXT,
+        device_sn TEXT,
+        product_line TEXT,
+        fault_type TEXT,
+        start_time TEXT,
+        end_time TEXT,
+        replacements TEXT,
+        final_report TEXT,
+        ai_critique TEXT,
+        created_at TEXT
+    );
+    ''',
+    # 2: 后台 LLM 任务队列
+    '''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ticket_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        run_after REAL NOT NULL,
+        locked_at REAL,
+        last_error TEXT,
+        created_at TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs (status, run_after);
+    CREATE INDEX IF NOT EXISTS idx_jobs_ticket ON jobs (ticket_id);
+    ''',
+    # 3: 看板/历史的筛选列索引（二级索引隐含 rowid，按 engineer_name 过滤后可直接按 id 倒序翻页）
+    '''
+    CREATE INDEX IF NOT EXISTS idx_tickets_engineer_name ON tickets (engineer_name);
+    CREATE INDEX IF NOT EXISTS idx_tickets_created_at ON tickets (created_at);
+    CREATE INDEX IF NOT EXISTS idx_tickets_fault_type ON tickets (fault_type);
+    ''',
+    # 4: 看板聚合表，按 天 × 责任人 × 故障类型 × 产品线 计数，写入工单时同事务增量更新
+    '''
+    CREATE TABLE IF NOT EXISTS ticket_stats (
+        day TEXT NOT NULL,
+        engineer_name TEXT NOT NULL,
+        fault_type TEXT NOT NULL,
+        product_line TEXT NOT NULL,
+        tickets INTEGER NOT NULL DEFAULT 0,
+        replaced_tickets INTEGER NOT NULL DEFAULT 0,
+        replaced_parts INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, engineer_name, fault_type, product_line)
+    ) WITHOUT ROWID;
+    ''',
+    # 5
+    _backfill_ticket_stats,
+    # 6: 换件流水拆成子表，按 QN / 件类型建索引；tickets.replacements 仍保留原始 JSON 供展示
+    '''
+    CREATE TABLE IF NOT EXISTS replacements (
+        ticket_id INTEGER NOT NULL REFERENCES tickets (id),
+        seq INTEGER NOT NULL,
+        replace_time TEXT,
+        action_info TEXT,
+        new_type TEXT,
+        new_qn TEXT,
+        old_type TEXT,
+        old_qn TEXT,
+        PRIMARY KEY (ticket_id, seq)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_replacements_new_qn ON replacements (new_qn);
+    CREATE INDEX IF NOT EXISTS idx_replacements_old_qn ON replacements (old_qn);
+    CREATE INDEX IF NOT EXISTS idx_replacements_new_type ON replacements (new_type);
+    CREATE INDEX IF NOT EXISTS idx_replacements_old_type ON replacements (old_type);
+    CREATE INDEX IF NOT EXISTS idx_tickets_device_sn ON tickets (device_sn);
+    ''',
+    # 7
+    _backfill_replacements,
+    # 8: 最终报告 + AI 点评全文检索，触发器保持与 tickets 同步
+    _create_tickets_fts,
+    # 9: 进行中工单的服务端草稿（每轮对话后整行覆盖），提交或放弃后 status 改掉，不再出现在恢复列表
+    '''
+    CREATE TABLE IF NOT EXISTS drafts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        engineer_name TEXT NOT NULL,
+        messages TEXT NOT NULL,
+        display_messages TEXT NOT NULL,
+        is_done INTEGER NOT NULL DEFAULT 0,
+        closure_json TEXT,
+        final_report TEXT,
+        extracted_data TEXT,
+        extraction_failed INTEGER NOT NULL DEFAULT 0,
+        ai_critique TEXT,
+        status TEXT NOT NULL DEFAULT 'open',
+        ticket_id INTEGER,
+        created_at TEXT,
+        updated_at TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_drafts_engineer_status ON drafts (engineer_name, status, updated_at);
+    ''',
+    # 10: 热路径埋点（metrics.py 批量写入），ts 为 unix 时间戳，按名称 + 时间窗口取样算分位数
+    '''
+    CREATE TABLE IF NOT EXISTS metrics (
+        id INTEGER PRIMARY KEY,
+        ts REAL NOT NULL,
+        name TEXT NOT NULL,
+        duration_ms REAL NOT NULL,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        detail TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_metrics_ts ON metrics (ts);
+    ''',
+    # 11: 聚合表拆成按维度的小汇总
+    _create_stats_rollups,
+    # 12: 已完成任务的对话历史不再保留（jobs.complete 之后也会清空）
+    '''
+    UPDATE jobs SET payload = '' WHERE status = 'done';
+    ''',
+    # 13: 性能面板按 name + 时间窗口取样本，带上取值列做成覆盖索引，不回表
+    '''
+    CREATE INDEX IF NOT EXISTS idx_metrics_name_ts ON metrics (name, ts, duration_ms, prompt_tokens, completion_tokens);
+    ''',
+]
+
+def migrate(conn):
+    # BEGIN IMMEDIATE 抢写锁后再读版本号，多个进程同时启动也只会有一个执行迁移
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for i, step in enumerate(MIGRATIONS[version:], start=version + 1):
+            if callable(step):
+                step(conn)
+            else:
+                for stmt in step.split(";"):
+                    if stmt.strip():
+                        conn.execute(stmt)
+            conn.execute(f"PRAGMA user_version = {i}")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+# ================= 2. 进程级连接 =================
+_lock = threading.RLock()
+_conn = None
+
+def get_conn():
+    global _conn
+    with _lock:
+        if _conn is None:
+            conn = sqlite3.connect(
+                DB_PATH,
+                timeout=BUSY_TIMEOUT_MS / 1000,
+                check_same_thread=False,   # 线程池回调、worker 线程共用，靠 _lock 串行
+                isolation_level=None,      # 自动提交，多语句写入显式走 transaction()
+                cached_statements=256,
+            )
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+            # tickets_fts 触发器依赖该函数，每条连接都要在写 tickets 之前注册
+            conn.create_function("cjk_segment", 1, cjk_segment, deterministic=True)
+            migrate(conn)
+            _conn = conn
+        return _conn
+
+def query(sql, params=()):
+    with _lock:
+        return get_conn().execute(sql, params).fetchall()
+
+def query_one(sql, params=()):
+    with _lock:
+        return get_conn().execute(sql, params).fetchone()
+
+def execute(sql, params=()):
+    with _lock:
+        return get_conn().execute(sql, params)
+
+@contextmanager
+def transaction():
+    """写事务：持有进程锁并以 BEGIN IMMEDIATE 提前拿到库级写锁，避免中途升级锁时撞上 busy。"""
+    with _lock:
+        conn = get_conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+def now_str():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+# ================= 3. 工单读写 =================
+def to_ticket_replacements(reps):
+    return [{zh: rep.get(en, "") for en, zh in REPLACEMENT_KEYS.items()} for rep in reps]
+
+def parse_replacements(replacements_json):
+    try:
+        reps = json.loads(replacements_json or "[]")
+    except ValueError:
+        return []
+    return reps if isinstance(reps, list) else []
+
+def count_replacements(reps):
+    # 表单没有换件时也会提交一行空白流水，只统计至少填了一个字段的行
+    return sum(1 for rep in reps if isinstance(rep, dict) and any(str(v).strip() for v in rep.values()))
+
+def _write_replacement_rows(conn, ticket_id, reps):
+    """按工单整体重写换件子表；seq 为表单中的行号（从 1 开始），空白行不落表。"""
+    conn.execute('DELETE FROM replacements WHERE ticket_id = ?', (ticket_id,))
+    conn.executemany('''
+        INSERT INTO replacements (ticket_id, seq, replace_time, action_info, new_type, new_qn, old_type, old_qn)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (ticket_id, seq, *(str(rep.get(zh, "")).strip() for zh in REPLACEMENT_KEYS.values()))
+        for seq, rep in enumerate(reps, start=1)
+        if count_replacements([rep])
+    ])
+
+def _bump_ticket_stats(conn, day, engineer_name, fault_type, product_line, tickets, parts):
+    """tickets 为 +1/-1（新增/撤销一张工单的贡献），parts 为该工单换件行数，方向与 tickets 相同。每个汇总各更新一行。"""
+    counts = (tickets, tickets if parts else 0, tickets * parts)
+    conn.executemany('''
+        INSERT INTO stats_rollups (dimension, day, value, tickets, replaced_tickets, replaced_parts)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (dimension, day, value) DO UPDATE SET
+            tickets = tickets + excluded.tickets,
+            replaced_tickets = replaced_tickets + excluded.replaced_tickets,
+            replaced_parts = replaced_parts + excluded.replaced_parts
+    ''', [
+        (ROLLUP_DAY, day, "", *counts),
+        ("engineer_name", day, engineer_name or "", *counts),
+        ("fault_type", day, fault_type or "", *counts),
+        ("product_line", day, product_line or "", *counts),
+        (ROLLUP_TOTAL, "", "", *counts),
+    ])
+
+def insert_ticket(engineer_name, device_sn, product_line, fault_type, start_time, end_time, replacements_json, final_report, ai_critique):
+    created_at = now_str()
+    reps = parse_replacements(replacements_json)
+    with transaction() as conn:
+        cur = conn.execute('''
+            INSERT INTO tickets (engineer_name, device_sn, product_line, fault_type, start_time, end_time, replacements, final_report, ai_critique, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (engineer_name, device_sn, product_line, fault_type, start_time, end_time, replacements_json, final_report, ai_critique, created_at))
+        _write_replacement_rows(conn, cur.lastrowid, reps)
+        _bump_ticket_stats(conn, created_at[:10], engineer_name, fault_type, product_line, 1, count_replacements(reps))
+        return cur.lastrowid
+
+def apply_extraction(conn, ticket_id, result):
+    """后台提取结果回写：只补录工程师提交时留空的字段，换件流水同理——工程师一行都没填时才用提取结果，聚合表同步修正。需在 transaction() 内调用。"""
+    old = conn.execute('''
+        SELECT created_at, engineer_name, fault_type, product_line, replacements FROM tickets WHERE id = ?
+    ''', (ticket_id,)).fetchone()
+    if old is None:
+        return
+    old_reps = parse_replacements(old[4])
+    # 不覆盖人工核对过的换件流水
+    reps = old_reps if count_replacements(old_reps) else to_ticket_replacements(result.get("replacements", []))
+    conn.execute('''
+        UPDATE tickets SET
+            device_sn = COALESCE(NULLIF(device_sn, ''), ?),
+            product_line = COALESCE(NULLIF(product_line, ''), ?),
+            fault_type = COALESCE(NULLIF(fault_type, ''), ?),
+            start_time = COALESCE(NULLIF(start_time, ''), ?),
+            end_time = COALESCE(NULLIF(end_time, ''), ?),
+            replacements = ?
+        WHERE id = ?
+    ''', (result.get("device_sn", ""), result.get("product_line", ""), result.get("fault_type", ""),
+          result.get("start_time", ""), result.get("end_time", ""),
+          json.dumps(reps, ensure_ascii=False), ticket_id))
+    new = conn.execute('SELECT fault_type, product_line FROM tickets WHERE id = ?', (ticket_id,)).fetchone()
+    if reps is not old_reps:
+        _write_replacement_rows(conn, ticket_id, reps)
+
+    created_at, engineer_name, old_fault, old_line, _ = old
+    day = (created_at or "")[:10]
+    _bump_ticket_stats(conn, day, engineer_name, old_fault, old_line, -1, count_replacements(old_reps))
+    _bump_ticket_stats(conn, day, engineer_name, new[0], new[1], 1, count_replacements(reps))
+
+# 列表查询一律按 id 做 keyset 分页：before_id 为上一页最后一行的 id，多取一行用来判断是否还有下一页
+def list_engineer_tickets(engineer_name, before_id=None, limit=PAGE_SIZE):
+    return query('''
+        SELECT id, device_sn, fault_type, created_at, final_report, replacements FROM tickets
+        WHERE engineer_name = ? AND id < COALESCE(?, 9223372036854775807)
+        ORDER BY id DESC LIMIT ?
+    ''', (engineer_name, before_id, limit + 1))
+
+def list_tickets(before_id=None, limit=PAGE_SIZE):
+    """看板列表只取摘要列，报告/点评等大字段在打开详情时再由 get_ticket 读取。"""
+    return query('''
+        SELECT id, engineer_name, device_sn, fault_type, created_at, ai_critique IS NOT NULL FROM tickets
+        WHERE id < COALESCE(?, 9223372036854775807)
+        ORDER BY id DESC LIMIT ?
+    ''', (before_id, limit + 1))
+
+def get_ticket(ticket_id):
+    return query_one('''
+        SELECT id, engineer_name, device_sn, fault_type, created_at, ai_critique, final_report, replacements FROM tickets
+        WHERE id = ?
+    ''', (ticket_id,))
+
+# ================= 4. 看板聚合（只读 stats_rollups，行数与工单量无关） =================
+STATS_DIMENSIONS = ("engineer_name", "fault_type", "product_line")
+ROLLUP_DAY = "day"      # 按天汇总，value 为空
+ROLLUP_TOTAL = "total"  # 全量总计，只有一行
+
+def stats_for_day(day=None):
+    """(工单数, 涉及换件单数, 换件数)"""
+    day = day or date.today().isoformat()
+    return query_one('''
+        SELECT tickets, replaced_tickets, replaced_parts FROM stats_rollups
+        WHERE dimension = ? AND day = ? AND value = ''
+    ''', (ROLLUP_DAY, day)) or (0, 0, 0)
+
+def stats_totals():
+    return query_one('''
+        SELECT tickets, replaced_tickets, replaced_parts FROM stats_rollups
+        WHERE dimension = ? AND day = '' AND value = ''
+    ''', (ROLLUP_TOTAL,)) or (0, 0, 0)
+
+def daily_trend(days=30):
+    """最近 days 天逐日 [(day, 工单数, 涉及换件单数, 换件数)]，没有工单的日期补 0。"""
+    start = date.today() - timedelta(days=days - 1)
+    rows = {r[0]: r for r in query('''
+        SELECT day, tickets, replaced_tickets, replaced_parts FROM stats_rollups
+        WHERE dimension = ? AND day >= ?
+    ''', (ROLLUP_DAY, start.isoformat()))}
+    buckets = [(start + timedelta(days=i)).isoformat() for i in range(days)]
+    return [rows.get(d, (d, 0, 0, 0)) for d in buckets]
+
+def stats_breakdown(dimension, days=30):
+    """最近 days 天按某一维度汇总 [(取值, 工单数, 换件数)]，按工单数降序。"""
+    if dimension not in STATS_DIMENSIONS:
+        raise ValueError(f"unknown stats dimension: {dimension}")
+    start = date.today() - timedelta(days=days - 1)
+    return query('''
+        SELECT value, SUM(tickets), SUM(replaced_parts) FROM stats_rollups
+        WHERE dimension = ? AND day >= ?
+        GROUP BY value ORDER BY SUM(tickets) DESC
+    ''', (dimension, start.isoformat()))
+
+# ================= 5. 换件溯源（走 replacements 子表索引） =================
+def find_parts_by_qn(qn):
+    """换上或换下过该 QN 的全部换件记录，按时间倒序。"""
+    return query('''
+        SELECT r.ticket_id, r.seq, t.created_at, t.engineer_name, t.device_sn, t.product_line,
+               r.replace_time, r.new_type, r.new_qn, r.old_type, r.old_qn
+        FROM replacements r JOIN tickets t ON t.id = r.ticket_id
+        WHERE r.new_qn = ? OR r.old_qn = ?
+        ORDER BY r.ticket_id DESC, r.seq
+    ''', (qn, qn))
+
+def find_tickets_by_sn(device_sn, limit=PAGE_SIZE):
+    return query('''
+        SELECT id, engineer_name, fault_type, product_line, created_at FROM tickets
+        WHERE device_sn = ? ORDER BY id DESC LIMIT ?
+    ''', (device_sn, limit))
+
+def part_consumption(since_day, product_line=None):
+    """since_day 起换上件按类型计数 [(换上件类型, 数量)]，可限定产品线。"""
+    # CROSS JOIN 固定以 tickets 为外表：先按 idx_tickets_created_at 圈出时间范围内的工单，再按主键探测其换件行；
+    # 否则规划器会走 idx_replacements_new_type 扫全部换件记录，耗时随历史总量增长而与所选时间范围无关
+    return query('''
+        SELECT r.new_type, COUNT(*) FROM tickets t CROSS JOIN replacements r ON r.ticket_id = t.id
+        WHERE t.created_at >= ? AND (? IS NULL OR t.product_line = ?) AND r.new_type != ''
+        GROUP BY r.new_type ORDER BY COUNT(*) DESC
+    ''', (since_day, product_line, product_line))
+
+def product_lines():
+    return [r[0] for r in query('''
+        SELECT DISTINCT value FROM stats_rollups
+        WHERE dimension = 'product_line' AND value != '' ORDER BY value
+    ''')]
+
+# ================= 6. 全文检索 =================
+HIGHLIGHT_OPEN = ":orange-background["
+HIGHLIGHT_CLOSE = "]"
+
+def build_fts_query(text):
+    """空格分隔的多个关键词取 AND；每个词按短语匹配，英文词以 * 结尾时做前缀匹配。"""
+    terms = []
+    for term in text.split():
+        prefix = term.endswith("*") and len(term) > 1
+        term = term.rstrip("*")
+        phrase = '"' + cjk_segment(term).replace('"', '""') + '"'
+        terms.append(phrase + "*" if prefix else phrase)
+    return " ".join(terms)
+
+def search_tickets(text, page=0, limit=PAGE_SIZE):
+    """按 bm25 相关度排序返回一页命中 [(id, 责任人, 设备SN, 故障类型, 提交时间, 报告摘要, 点评摘要)]，多取一行判断是否还有下一页。"""
+    fts_query = build_fts_query(text)
+    if not fts_query:
+        return []
+    rows = query('''
+        SELECT t.id, t.engineer_name, t.device_sn, t.fault_type, t.created_at,
+               snippet(tickets_fts, 0, ?, ?, '…', 24),
+               snippet(tickets_fts, 1, ?, ?, '…', 24)
+        FROM tickets_fts JOIN tickets t ON t.id = tickets_fts.rowid
+        WHERE tickets_fts MATCH ?
+        ORDER BY rank
+        LIMIT ? OFFSET ?
+    ''', (HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE, HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE, fts_query, limit + 1, page * limit))
+    return [r[:5] + tuple((snip or "").replace(FTS_SEPARATOR, "").replace("\n", " ") for snip in r[5:]) for r in rows]
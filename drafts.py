@@ -0,0 +1,131 @@
+"""
+进行中工单的服务端草稿：每轮对话后落库，断线/重启后可按草稿 ID 恢复。
+
+st.session_state 只保存 draft_id，对话内容放在本模块的进程级 LRU 里，闲置超时即淘汰（需要时从库里重新读），
+所以无论开多少个标签页，worker 进程的内存占用只取决于 MAX_CACHED_DRAFTS 和仍在执行中的 LLM 请求数。
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import db
+
+MAX_CACHED_DRAFTS = 200
+IDLE_SECONDS = 15 * 60
+
+GREETING = "你好！请描述现场排查流水账。如果有 SN号、换件 QN 码也请一并带上。"
+
+# 草稿里以 JSON 存储的字段
+_JSON_FIELDS = ("messages", "display_messages", "extracted_data")
+_FIELDS = ("messages", "display_messages", "is_done", "closure_json", "final_report",
+           "extracted_data", "extraction_failed", "ai_critique")
+
+_lock = threading.RLock()
+_cache = OrderedDict()      # draft_id -> (last_access, draft)
+_inflight = {}              # draft_id -> {"extraction": Future, "critique": Future}，仅本进程有效
+
+
+def new_draft(engineer_name, system_prompt):
+    """尚未落库的新草稿（id 为 None），工程师发出第一句话时再 save，避免空草稿堆积。"""
+    return {
+        "id": None,
+        "engineer_name": engineer_name,
+        "messages": [{"role": "system", "content": system_prompt}],
+        "display_messages": [{"role": "assistant", "content": GREETING}],
+        "is_done": False,
+        "closure_json": None,
+        "final_report": None,
+        "extracted_data": None,
+        "extraction_failed": False,
+        "ai_critique": None,
+    }
+
+# ================= 进程级缓存 =================
+def _touch(draft):
+    _cache[draft["id"]] = (time.monotonic(), draft)
+    _cache.move_to_end(draft["id"])
+    now = time.monotonic()
+    while _cache:
+        oldest_id, (last_access, _) = next(iter(_cache.items()))
+        if len(_cache) <= MAX_CACHED_DRAFTS and now - last_access <= IDLE_SECONDS:
+            break
+        _cache.pop(oldest_id)
+    # 已淘汰草稿的在途请求一旦全部结束就丢掉（结果已由回调写库）；还在跑的留到下次淘汰时再看
+    for draft_id in [d for d, futures in _inflight.items()
+                     if d not in _cache and all(f.done() for f in futures.values())]:
+        _inflight.pop(draft_id)
+
+def _from_row(row):
+    draft = dict(zip(("id", "engineer_name") + _FIELDS, row))
+    for field in _JSON_FIELDS:
+        draft[field] = json.loads(draft[field]) if draft[field] is not None else None
+    draft["is_done"] = bool(draft["is_done"])
+    draft["extraction_failed"] = bool(draft["extraction_failed"])
+    return draft
+
+def load(draft_id):
+    """按 ID 取仍处于 open 状态的草稿；缓存未命中（闲置被淘汰或进程重启）时从库里恢复。"""
+    with _lock:
+        if draft_id in _cache:
+            draft = _cache[draft_id][1]
+        else:
+            row = db.query_one(f'''
+                SELECT id, engineer_name, {", ".join(_FIELDS)} FROM drafts
+                WHERE id = ? AND status = 'open'
+            ''', (draft_id,))
+            if row is None:
+                return None
+            draft = _from_row(row)
+        _touch(draft)
+        return draft
+
+def save(draft):
+    with _lock:
+        # 快照必须在锁内取：点评回调经 update() 写入 ai_critique 也持这把锁，锁外取的旧快照会把它覆盖回 NULL
+        values = [json.dumps(draft[f], ensure_ascii=False) if f in _JSON_FIELDS and draft[f] is not None else draft[f] for f in _FIELDS]
+        if draft["id"] is None:
+            cur = db.execute(f'''
+                INSERT INTO drafts (engineer_name, {", ".join(_FIELDS)}, status, created_at, updated_at)
+                VALUES (?, {", ".join("?" for _ in _FIELDS)}, 'open', ?, ?)
+            ''', (draft["engineer_name"], *values, db.now_str(), db.now_str()))
+            draft["id"] = cur.lastrowid
+        else:
+            db.execute(f'''
+                UPDATE drafts SET {", ".join(f"{f} = ?" for f in _FIELDS)}, updated_at = ?
+                WHERE id = ?
+            ''', (*values, db.now_str(), draft["id"]))
+        _touch(draft)
+    return draft["id"]
+
+def update(draft_id, **fields):
+    """供线程池回调写入单个结果（提取/点评）；草稿在缓存里则同步更新缓存，不在就只写库。"""
+    with _lock:
+        if draft_id in _cache:
+            _cache[draft_id][1].update(fields)
+        db.execute(f'''
+            UPDATE drafts SET {", ".join(f"{f} = ?" for f in fields)}, updated_at = ?
+            WHERE id = ? AND status = 'open'
+        ''', (*(json.dumps(v, ensure_ascii=False) if k in _JSON_FIELDS and v is not None else v for k, v in fields.items()),
+              db.now_str(), draft_id))
+
+def close(draft_id, status, ticket_id=None):
+    """提交（submitted）或放弃（discarded）草稿，之后不再出现在恢复列表里。"""
+    with _lock:
+        db.execute('UPDATE drafts SET status = ?, ticket_id = ?, updated_at = ? WHERE id = ?',
+                   (status, ticket_id, db.now_str(), draft_id))
+        _cache.pop(draft_id, None)
+        _inflight.pop(draft_id, None)
+
+def list_open(engineer_name, limit=20):
+    """[(id, 更新时间, 第一句描述)]，最近更新的在前。"""
+    return db.query('''
+        SELECT id, updated_at, substr(json_extract(display_messages, '$[1].content'), 1, 30) FROM drafts
+        WHERE engineer_name = ? AND status = 'open'
+        ORDER BY updated_at DESC LIMIT ?
+    ''', (engineer_name, limit))
+
+# ================= 本进程内在途的 LLM 请求 =================
+def inflight(draft_id):
+    with _lock:
+        return _inflight.setdefault(draft_id, {})
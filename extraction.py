@@ -0,0 +1,92 @@
+"""
+闭环回复中的结构化提取：边流式接收边切分 <FINAL_REPORT> 正文与 <EXTRACTION_JSON> 附录，
+并按 JSON_EXTRACTION_PROMPT 的字段定义逐字段校验，标出需要定向修复的字段。
+"""
+import json
+
+EXTRACTION_OPEN = "<EXTRACTION_JSON>"
+EXTRACTION_CLOSE = "</EXTRACTION_JSON>"
+
+TICKET_FIELDS = ("device_sn", "product_line", "fault_type", "start_time", "end_time")
+REPLACEMENT_FIELDS = ("replace_time", "action_info", "new_type", "new_qn", "old_type", "old_qn")
+
+
+# ================= 1. 流式切分 =================
+class ClosureStreamParser:
+    """逐片 feed 模型输出；visible 为可以渲染给工程师的正文，附录开始后不再增长。"""
+
+    def __init__(self):
+        self.text = ""
+        self._open_at = -1
+
+    def feed(self, delta):
+        self.text += delta
+        if self._open_at < 0:
+            self._open_at = self.text.find(EXTRACTION_OPEN)
+
+    @property
+    def visible(self):
+        if self._open_at >= 0:
+            return self.text[:self._open_at]
+        # 结尾可能是半个附录标签（如 "<EXTRAC"），先不渲染
+        for i in range(min(len(EXTRACTION_OPEN) - 1, len(self.text)), 0, -1):
+            if EXTRACTION_OPEN.startswith(self.text[-i:]):
+                return self.text[:-i]
+        return self.text
+
+    @property
+    def report(self):
+        return self.text[:self._open_at] if self._open_at >= 0 else self.text
+
+    @property
+    def json_text(self):
+        """附录里的 JSON 原文；没有附录时为 None。模型漏写结束标签时取到结尾。"""
+        if self._open_at < 0:
+            return None
+        body = self.text[self._open_at + len(EXTRACTION_OPEN):]
+        end = body.find(EXTRACTION_CLOSE)
+        if end >= 0:
+            body = body[:end]
+        return body.strip().replace("```json", "").replace("```", "").strip()
+
+
+# ================= 2. 字段校验 =================
+def _as_text(value):
+    # 数字、null 之类可以无损转成表单里的字符串；对象/数组说明模型把字段写错了
+    if value is None:
+        return ""
+    if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        return str(value).strip()
+    raise ValueError(f"expected a string, got {type(value).__name__}")
+
+def validate_extraction(data):
+    """
+    返回 (规整后的提取结果, 缺失或不合法的顶层字段列表)。
+    换件行内缺的键按空值补齐；不合法的字段在结果里先置为空值，修复成功后再覆盖；replacements 中任一行不合法即整体标记。
+    """
+    if not isinstance(data, dict):
+        return {field: "" for field in TICKET_FIELDS} | {"replacements": []}, list(TICKET_FIELDS) + ["replacements"]
+
+    clean, invalid = {}, []
+    for field in TICKET_FIELDS:
+        try:
+            if field not in data:
+                raise ValueError(f"missing field {field}")
+            clean[field] = _as_text(data[field])
+        except ValueError:
+            clean[field] = ""
+            invalid.append(field)
+
+    reps = data.get("replacements")
+    try:
+        if not isinstance(reps, list) or not all(isinstance(rep, dict) for rep in reps):
+            raise ValueError("replacements must be a list of objects")
+        clean["replacements"] = [{key: _as_text(rep.get(key)) for key in REPLACEMENT_FIELDS} for rep in reps]
+    except ValueError:
+        clean["replacements"] = []
+        invalid.append("replacements")
+    return clean, invalid
+
+def parse_extraction(json_text):
+    """解析 + 校验；JSON 整体无法解析时抛 ValueError（json.JSONDecodeError 是其子类）。"""
+    return validate_extraction(json.loads(json_text))
@@ -0,0 +1,85 @@
+import json
+import random
+import time
+
+import db
+
+JOB_EXTRACTION = "extraction"
+JOB_CRITIQUE = "critique"
+JOB_RECRITIQUE = "recritique"
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 10       # 秒，第 n 次失败后等待 BASE * 2^(n-1)
+BACKOFF_MAX = 600
+LEASE_SECONDS = 300     # worker 崩溃后，running 超过租期的任务会被重新领取
+
+# ================= 入队 =================
+def enqueue(ticket_id, kind, messages, delay=0):
+    """为工单登记一个后台 LLM 任务，payload 保存完整对话，worker 重启后可照常重放。"""
+    cur = db.execute('''
+        INSERT INTO jobs (ticket_id, kind, payload, run_after, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (ticket_id, kind, json.dumps(messages, ensure_ascii=False), time.time() + delay, db.now_str()))
+    return cur.lastrowid
+
+def release(job_id):
+    # 应用内先行计算失败时调用：不再等延迟，立刻交给 worker
+    db.execute("UPDATE jobs SET run_after = ? WHERE id = ? AND status = 'pending'", (time.time(), job_id))
+
+# ================= 领取 / 完成 / 失败 =================
+def claim(limit):
+    """原子地领取最多 limit 个到期任务，返回 [(id, ticket_id, kind, messages)]。"""
+    now = time.time()
+    with db.transaction() as conn:
+        rows = conn.execute('''
+            SELECT id, ticket_id, kind, payload FROM jobs
+            WHERE (status = 'pending' AND run_after <= ?)
+               OR (status = 'running' AND locked_at <= ?)
+            ORDER BY run_after
+            LIMIT ?
+        ''', (now, now - LEASE_SECONDS, limit)).fetchall()
+        conn.executemany(
+            "UPDATE jobs SET status = 'running', locked_at = ? WHERE id = ?",
+            [(now, r[0]) for r in rows],
+        )
+    return [(job_id, ticket_id, kind, json.loads(payload)) for job_id, ticket_id, kind, payload in rows]
+
+def _write_result(conn, ticket_id, kind, result):
+    if kind == JOB_EXTRACTION:
+        db.apply_extraction(conn, ticket_id, result)
+    else:
+        conn.execute('UPDATE tickets SET ai_critique = ? WHERE id = ?', (result, ticket_id))
+
+def complete(job_id, ticket_id, kind, result, only_if_pending=False):
+    """写回工单并把任务标记为 done，二者在同一事务内。返回是否真正写入。"""
+    with db.transaction() as conn:
+        status_filter = "status = 'pending'" if only_if_pending else "status IN ('pending', 'running')"
+        # 对话历史只在执行时有用，完成后清空，done 任务不再长期占着整段 payload
+        cur = conn.execute(f"UPDATE jobs SET status = 'done', payload = '', last_error = NULL WHERE id = ? AND {status_filter}", (job_id,))
+        if cur.rowcount:
+            _write_result(conn, ticket_id, kind, result)
+    return bool(cur.rowcount)
+
+def fail(job_id, error):
+    with db.transaction() as conn:
+        attempts = conn.execute('SELECT attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()[0] + 1
+        if attempts >= MAX_ATTEMPTS:
+            conn.execute("UPDATE jobs SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                         (attempts, str(error), job_id))
+        else:
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+            conn.execute("UPDATE jobs SET status = 'pending', attempts = ?, run_after = ?, locked_at = NULL, last_error = ? WHERE id = ?",
+                         (attempts, time.time() + delay, str(error), job_id))
+
+# ================= 看板查询 =================
+def open_critique_jobs():
+    """{ticket_id: status}，列出点评仍在排队/执行中或已彻底失败的工单。"""
+    # 先经 idx_jobs_status_run_after 只取未完成的任务，再按 idx_jobs_ticket 确认它是该工单最新的一次点评，不随 done 任务累积而变慢
+    rows = db.query('''
+        SELECT j.ticket_id, j.status FROM jobs j
+        WHERE j.status IN ('pending', 'running', 'failed') AND j.kind IN (?, ?)
+          AND NOT EXISTS (
+              SELECT 1 FROM jobs n WHERE n.ticket_id = j.ticket_id AND n.kind IN (?, ?) AND n.id > j.id
+          )
+    ''', (JOB_CRITIQUE, JOB_RECRITIQUE, JOB_CRITIQUE, JOB_RECRITIQUE))
+    return dict(rows)
@@ -0,0 +1,119 @@
+import json
+import logging
+import os
+import tomllib
+
+from openai import OpenAI
+
+import metrics
+from context import log_usage, pick_model
+from extraction import TICKET_FIELDS, parse_extraction, validate_extraction
+from llm_cache import ResponseCache, cache_key
+from prompts import JSON_EXTRACTION_PROMPT, JSON_EXTRACTION_PROMPT_VERSION, EXTRACTION_REPAIR_PROMPT, CRITIQUE_PROMPT
+
+log = logging.getLogger("llm")
+
+# 压测/离线调试时指向 bench/mock_server.py 之类的 OpenAI 兼容服务
+MOONSHOT_BASE_URL = os.environ.get("MOONSHOT_BASE_URL", "https://api.moonshot.cn/v1")
+
+_ALL_FIELDS = set(TICKET_FIELDS) | {"replacements"}
+
+# 进程级响应缓存，跨会话共享；磁盘部分由 Streamlit 与 worker.py 共用
+response_cache = ResponseCache()
+
+# ================= 客户端 =================
+def load_api_key(secrets_path=".streamlit/secrets.toml"):
+    """后台 worker 没有 st.secrets，先读环境变量，再读 Streamlit 的 secrets 文件。"""
+    if os.environ.get("MOONSHOT_API_KEY"):
+        return os.environ["MOONSHOT_API_KEY"]
+    with open(secrets_path, "rb") as f:
+        return tomllib.load(f)["MOONSHOT_API_KEY"]
+
+def make_client(api_key):
+    # 重试统一交给 scheduler（带全局限流与抖动退避），SDK 自带的重试关掉以免叠加
+    return OpenAI(api_key=api_key, base_url=MOONSHOT_BASE_URL, max_retries=0)
+
+# ================= 闭环后的两路请求 =================
+def run_extraction(client, messages, use_cache=True):
+    extract_msgs = messages + [{"role": "user", "content": JSON_EXTRACTION_PROMPT}]
+    model = pick_model(extract_msgs)
+    key = cache_key(model, 0.1, JSON_EXTRACTION_PROMPT_VERSION, extract_msgs)
+    if use_cache and (cached := response_cache.get(key)) is not None:
+        return parse_extraction(cached)[0]
+
+    with metrics.timer("llm.extraction") as m:
+        json_res = client.chat.completions.create(
+            model=model, messages=extract_msgs, temperature=0.1
+        )
+        m.update(log_usage("extraction", model, extract_msgs, json_res))
+    raw_json = json_res.choices[0].message.content.strip().replace("```json", "").replace("```", "")
+    try:
+        raw = json.loads(raw_json)
+    except ValueError:
+        raw = {}
+    data, invalid = validate_extraction(raw)
+    if invalid:
+        # 不合法的回复不入缓存；和附录路径一样只修坏字段（报告取闭环那条 assistant 回复），
+        # 一个合法字段都没有且修复失败时 repair_extraction 抛错，由调用方兜底（后台任务按退避重试）
+        report = messages[-1]["content"] if messages and messages[-1]["role"] == "assistant" else ""
+        return repair_extraction(client, report, data, invalid, raw if isinstance(raw, dict) else {})
+    if use_cache:
+        response_cache.put(key, raw_json)
+    return data
+
+def repair_extraction(client, report, data, invalid, raw_values=None):
+    """只针对不合法字段、只带最终报告做一次修复请求，修复结果合并回 data；修复失败的字段保持空值交给工程师填写。"""
+    raw_values = raw_values or {}
+    repair_msgs = [
+        {"role": "system", "content": EXTRACTION_REPAIR_PROMPT},
+        {"role": "user", "content": (
+            f"【最终报告】\n{report}\n\n"
+            f"【需要修复的字段】{', '.join(invalid)}\n"
+            f"【原始取值】{json.dumps({k: raw_values.get(k) for k in invalid}, ensure_ascii=False)}"
+        )},
+    ]
+    model = pick_model(repair_msgs)
+    try:
+        with metrics.timer("llm.extraction_repair") as m:
+            res = client.chat.completions.create(model=model, messages=repair_msgs, temperature=0.1)
+            m.update(log_usage("extraction_repair", model, repair_msgs, res))
+        raw_json = res.choices[0].message.content.strip().replace("```json", "").replace("```", "")
+        fixed, still_invalid = validate_extraction(json.loads(raw_json))
+        if set(still_invalid) >= _ALL_FIELDS:
+            raise ValueError("repair reply has no valid field")
+    except Exception as e:
+        # 附录里一个合法字段都没有时，交给调用方走整单提取失败的兜底（后台任务补录）；否则保留合法字段，坏字段留空
+        if set(invalid) >= _ALL_FIELDS:
+            raise
+        log.warning("extraction repair failed for %s, leaving them blank: %s", ", ".join(invalid), e)
+        return data
+    for field in invalid:
+        if field not in still_invalid:
+            data[field] = fixed[field]
+    return data
+
+def complete_closure_extraction(client, report, json_text, messages):
+    """
+    闭环回复自带提取附录时优先使用它：全部合法则不再请求；个别字段不合法只修这些字段；
+    附录整体解析失败时用报告做一次全字段修复；模型没写附录时才退回带完整历史的 run_extraction。
+    """
+    if json_text is None:
+        return run_extraction(client, messages)
+    try:
+        raw = json.loads(json_text)
+    except ValueError:
+        raw = {}
+    data, invalid = validate_extraction(raw)
+    if invalid:
+        data = repair_extraction(client, report, data, invalid, raw if isinstance(raw, dict) else {})
+    return data
+
+def run_critique(client, messages):
+    crit_msgs = messages + [{"role": "user", "content": CRITIQUE_PROMPT}]
+    model = pick_model(crit_msgs)
+    with metrics.timer("llm.critique") as m:
+        crit_res = client.chat.completions.create(
+            model=model, messages=crit_msgs, temperature=0.3
+        )
+        m.update(log_usage("critique", model, crit_msgs, crit_res))
+    return crit_res.choices[0].message.content
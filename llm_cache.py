@@ -0,0 +1,107 @@
+"""
+LLM 响应缓存：按 (模型, 温度, prompt 版本, messages) 的内容哈希寻址。
+
+内存 LRU 在前，独立的 llm_cache.db 在后（与工单库分开，可随时删除），磁盘总量超限时按最近访问时间淘汰。
+只给确定性的请求用（例如 JSON 提取），调用方在结果校验通过后再 put，避免把坏结果缓存下来。
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_DB_PATH = "llm_cache.db"
+MEMORY_ENTRIES = 256
+DISK_MAX_BYTES = 64 * 1024 * 1024
+
+
+def cache_key(model, temperature, prompt_version, messages):
+    raw = json.dumps(
+        {"model": model, "temperature": temperature, "prompt_version": prompt_version, "messages": messages},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_DB_PATH, memory_entries=MEMORY_ENTRIES, disk_max_bytes=DISK_MAX_BYTES):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+    def _disk(self):
+        # 第一次用到时才建库，未启用缓存的进程不会生成文件
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)')
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return self._memory[key]
+            row = self._disk().execute('SELECT value FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._disk().execute('UPDATE responses SET last_access = ? WHERE key = ?', (time.time(), key))
+            self._remember(key, row[0])
+            self.hits_disk += 1
+            return row[0]
+
+    def put(self, key, value):
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._remember(key, value)
+            conn = self._disk()
+            conn.execute('INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)',
+                         (key, value, size, time.time()))
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            if total > self.disk_max_bytes:
+                self._evict(conn, total - int(self.disk_max_bytes * 0.9))
+
+    def _evict(self, conn, need_bytes):
+        # 一次多腾出 10% 空间，避免临界状态下每次写入都触发淘汰
+        freed = 0
+        victims = []
+        for key, size in conn.execute('SELECT key, size FROM responses ORDER BY last_access').fetchall():
+            if freed >= need_bytes:
+                break
+            victims.append((key,))
+            freed += size
+        conn.executemany('DELETE FROM responses WHERE key = ?', victims)
+
+    def stats(self):
+        hits = self.hits_memory + self.hits_disk
+        total = hits + self.misses
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
@@ -0,0 +1,115 @@
+"""
+热路径埋点：rerun 耗时、看板/历史查询耗时、LLM 延迟与 token 数、闭环到表单就绪的端到端耗时，写入工单库的 metrics 表。
+
+记录先进内存缓冲，攒够 FLUSH_EVERY 条或超过 FLUSH_SECONDS 秒再批量落库，埋点本身不给每次 rerun 增加一次写事务。
+SQLite 没有分位数函数，p50 / p95 按 name 逐个从覆盖索引里取出整个时间窗口的样本，在 Python 里排序后算。
+"""
+import atexit
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+import db
+
+FLUSH_EVERY = 50
+FLUSH_SECONDS = 5.0
+RETENTION_DAYS = 14
+
+_lock = threading.Lock()
+_buffer = []
+_last_flush = time.monotonic()
+_last_prune = 0.0
+
+
+# ================= 1. 记录 =================
+def record(name, duration_ms, prompt_tokens=None, completion_tokens=None, detail=None):
+    with _lock:
+        _buffer.append((time.time(), name, duration_ms, prompt_tokens, completion_tokens, detail))
+        if len(_buffer) < FLUSH_EVERY and time.monotonic() - _last_flush < FLUSH_SECONDS:
+            return
+    flush()
+
+@contextmanager
+def timer(name, detail=None):
+    """计时一段代码；调用方可往 yield 出来的 dict 里填 prompt_tokens / completion_tokens / detail。异常退出同样记录。"""
+    fields = {}
+    started = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        record(name, (time.perf_counter() - started) * 1000,
+               fields.get("prompt_tokens"), fields.get("completion_tokens"), fields.get("detail", detail))
+
+def timed(name):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def flush():
+    global _last_flush, _last_prune
+    with _lock:
+        rows = _buffer[:]
+        _buffer.clear()
+        _last_flush = time.monotonic()
+        prune = time.time() - _last_prune > 3600
+        if prune:
+            _last_prune = time.time()
+    if not rows and not prune:
+        return
+    with db.transaction() as conn:
+        conn.executemany('''
+            INSERT INTO metrics (ts, name, duration_ms, prompt_tokens, completion_tokens, detail)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        if prune:
+            conn.execute('DELETE FROM metrics WHERE ts < ?', (time.time() - RETENTION_DAYS * 86400,))
+
+atexit.register(flush)
+
+# ================= 2. 汇总 =================
+def percentile(sorted_values, q):
+    # nearest-rank，样本少时也不会插值出不存在的值
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+def _names():
+    # 在 (name, ts) 索引上逐个跳到下一个 name，名称只有几十个，不必为 DISTINCT 扫整张表
+    return [name for (name,) in db.query('''
+        WITH RECURSIVE names(name) AS (
+            SELECT MIN(name) FROM metrics
+            UNION ALL
+            SELECT (SELECT MIN(name) FROM metrics WHERE name > names.name) FROM names WHERE names.name IS NOT NULL
+        )
+        SELECT name FROM names WHERE name IS NOT NULL
+    ''')]
+
+def summary(hours=24, prefix=""):
+    """[(name, 次数, p50 ms, p95 ms, 平均 prompt tokens, 平均 completion tokens)]，按 name 排序；每个 name 都覆盖整个时间窗口。"""
+    flush()
+    since = time.time() - hours * 3600
+    result = []
+    for name in _names():
+        if not name.startswith(prefix):
+            continue
+        # 只读 idx_metrics_name_ts 覆盖索引；不在 SQL 里 ORDER BY，临时 B 树排序比 Python 排序慢得多
+        rows = db.query('''
+            SELECT duration_ms, prompt_tokens, completion_tokens FROM metrics WHERE name = ? AND ts >= ?
+        ''', (name, since))
+        if not rows:
+            continue
+        durations = sorted(r[0] for r in rows)
+        prompts = [r[1] for r in rows if r[1] is not None]
+        completions = [r[2] for r in rows if r[2] is not None]
+        result.append((
+            name, len(durations), percentile(durations, 0.5), percentile(durations, 0.95),
+            sum(prompts) / len(prompts) if prompts else None,
+            sum(completions) / len(completions) if completions else None,
+        ))
+    return result
@@ -43,9 +43,8 @@ AGENT_SYSTEM_PROMPT = """
 # =====================================================================
 # 隐藏任务：JSON 表单结构化提取 Prompt
 # =====================================================================
-JSON_EXTRACTION_PROMPT = """
-请根据以上的完整对话历史，提取工单关键信息。必须输出合法 JSON，无 Markdown 符号。
-字段如下：
+# 提取字段定义：单独的提取请求与闭环附录共用同一份字段说明
+EXTRACTION_FIELDS = """
 {
     "device_sn": "设备SN号，若无请填 未知",
     "product_line": "产品线/机型，若无请填 未知",
@@ -66,6 +65,25 @@ JSON_EXTRACTION_PROMPT = """
 注：如果没有换件，replacements 为空数组 []。如果有多次换件，请按顺序排列成多个对象。
 """
 
+# 提取结果会进 LLM 响应缓存；调整提取口径（而提示词文本不变）时递增，让旧缓存失效
+JSON_EXTRACTION_PROMPT_VERSION = 1
+
+JSON_EXTRACTION_PROMPT = """
+请根据以上的完整对话历史，提取工单关键信息。必须输出合法 JSON，无 Markdown 符号。
+字段如下：""" + EXTRACTION_FIELDS
+
+# 闭环模式：最终报告与结构化提取在同一次回复中给出，省掉一次全量上下文的提取请求
+CLOSURE_EXTRACTION_PROMPT = """
+# 闭环附录（仅路径 2 使用，路径 1 的追问回复中严禁输出）
+写完最终排查总结报告后，另起一行输出标签 <EXTRACTION_JSON>，紧接着输出一段合法 JSON（不要使用 Markdown 代码块），最后以 </EXTRACTION_JSON> 结尾。
+该 JSON 用于自动填写工单表单，字段如下：""" + EXTRACTION_FIELDS
+
+# 附录中个别字段格式不合法时，仅针对这些字段的修复请求
+EXTRACTION_REPAIR_PROMPT = """
+下面是一份工单最终报告，以及从中提取出的 JSON 里格式不合法的字段。
+请只针对这些字段重新提取，输出一个合法 JSON 对象，键名与给出的字段完全一致，不要输出其他字段，不要使用 Markdown 符号。
+字段定义参考：""" + EXTRACTION_FIELDS
+
 # =====================================================================
 # 3. 生成评价报告 Prompt (赋予顶尖技术总监)
 # =====================================================================
@@ -93,3 +111,15 @@ CRITIQUE_PROMPT = """
 ## 四、 针对性纠偏指导（SOP 级别）
 （告诉工程师真实环境下最安全且成本最优的 SOP，必须提及 BMC、日志或特定排查指令）
 """
+
+# =====================================================================
+# 4. 长对话压缩 Prompt (上下文超出预算时，把较早的轮次浓缩为前情摘要)
+# =====================================================================
+CONTEXT_SUMMARY_PROMPT = """
+你是工单复核系统的记录员。下面是一段现场工程师与复核 Agent 之间较早的对话记录（可能包含上一次的前情摘要）。
+请把它压缩成一份简洁的前情摘要，供 Agent 继续追问时参考：
+1. 按时间顺序列出工程师已经交代的故障现象、排查动作及结果、换件动作；
+2. 列出 Agent 已经提出、工程师已经回答的追问，以及仍未回答的追问；
+3. 所有 SN 号、QN 码、槽位号、报错码、时间点必须原样保留，严禁改写或省略；
+4. 不要评价，不要输出与排查无关的内容，控制在 500 字以内。
+"""
@@ -0,0 +1,219 @@
+"""
+进程级 LLM 调度器：所有会话共用的令牌桶限流（请求数/分钟 + token 数/分钟）与并发上限，
+交互式对话优先于后台点评；429 / 5xx / 网络错误按带抖动的指数退避重试。
+
+用法：scheduled(client, PRIORITY_INTERACTIVE).chat.completions.create(...)，与原生 client 调用方式一致。
+"""
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+import openai
+
+import metrics
+from context import COMPLETION_RESERVE, count_tokens
+
+log = logging.getLogger("llm")
+
+PRIORITY_INTERACTIVE = 0    # 工程师正在等待的请求：对话轮次、表单提取
+PRIORITY_BACKGROUND = 1     # 点评、重新点评、worker 任务
+
+REQUESTS_PER_MINUTE = 60
+TOKENS_PER_MINUTE = 64000
+MAX_CONCURRENCY = 8
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0          # 秒
+BACKOFF_MAX = 30.0
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """距离桶里攒够 amount 还要多久；超过容量的单次请求按满桶放行，避免永远等不到。"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+
+class LLMScheduler:
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 max_concurrency=MAX_CONCURRENCY):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self._waiting = []                  # 堆：(priority, seq)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._waits = deque(maxlen=200)     # 最近的排队耗时，用于看板展示
+        self.retries = 0
+
+    # ================= 排队与放行 =================
+    def acquire(self, priority, est_tokens):
+        entry = (priority, next(self._seq))
+        enqueued = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            while True:
+                timeout = None
+                if self._waiting[0] == entry and self.in_flight < self.max_concurrency:
+                    now = time.monotonic()
+                    timeout = max(self.requests.wait_time(1, now), self.tokens.wait_time(est_tokens, now))
+                    if timeout == 0:
+                        break
+                self._cond.wait(timeout)
+            heapq.heappop(self._waiting)
+            self.requests.take(1)
+            self.tokens.take(est_tokens)
+            self.in_flight += 1
+            self._waits.append(time.monotonic() - enqueued)
+            # 队首换人了，唤醒其他等待者重新检查
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    # ================= 带重试的调用 =================
+    def call(self, fn, priority, est_tokens, hold_until=None):
+        """
+        排队后执行 fn()；hold_until 用于流式响应：hold_until(result, release) 返回包装后的流，由它在流结束或被丢弃时释放并发名额。
+        可重试的错误重新排队，不会占着并发名额睡眠。
+        """
+        attempt = 0
+        while True:
+            self.acquire(priority, est_tokens)
+            try:
+                result = fn()
+            except (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError) as e:
+                self.release()
+                if attempt >= MAX_RETRIES:
+                    raise
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                self.retries += 1
+                log.warning("LLM call retry %s/%s in %.1fs: %s", attempt, MAX_RETRIES, delay, e)
+                time.sleep(delay)
+                continue
+            except Exception:
+                self.release()
+                raise
+            if hold_until is not None:
+                return hold_until(result, self.release)
+            self.release()
+            return result
+
+    @staticmethod
+    def _backoff(attempt, error):
+        # 服务端给了 Retry-After 就照做，否则 full jitter 指数退避
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(BACKOFF_MAX, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self._waits)
+            return {
+                "queue_depth": len(self._waiting),
+                "in_flight": self.in_flight,
+                "avg_wait": sum(waits) / len(waits) if waits else 0.0,
+                "p95_wait": metrics.percentile(waits, 0.95),
+                "retries": self.retries,
+            }
+
+
+class _ReleasingStream:
+    """
+    包一层流式响应：迭代结束、出错、close() 或对象被回收时归还并发名额，最多归还一次。
+    调用方拿到流后一次都没迭代就丢掉（比如先抛了异常），名额也能在回收时还回来。
+    """
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+        self._released = False
+        self._lock = threading.Lock()
+        self._iter = iter(stream)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iter)
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        try:
+            if hasattr(self._stream, "close"):
+                self._stream.close()
+        finally:
+            self._release()
+
+    def __del__(self):
+        self.close()
+
+
+# ================= 与 OpenAI client 同形的包装 =================
+class _ScheduledCompletions:
+    def __init__(self, client, scheduler, priority):
+        self._client = client
+        self._scheduler = scheduler
+        self._priority = priority
+
+    def create(self, **kwargs):
+        est_tokens = count_tokens(kwargs.get("messages", [])) + kwargs.get("max_tokens", COMPLETION_RESERVE)
+        hold = _ReleasingStream if kwargs.get("stream") else None
+        return self._scheduler.call(lambda: self._client.chat.completions.create(**kwargs),
+                                    self._priority, est_tokens, hold_until=hold)
+
+
+class _ScheduledChat:
+    def __init__(self, completions):
+        self.completions = completions
+
+
+class ScheduledClient:
+    def __init__(self, client, scheduler, priority):
+        self.chat = _ScheduledChat(_ScheduledCompletions(client, scheduler, priority))
+
+
+# 进程级单例：Streamlit 各会话与线程池共用，worker.py 进程各有一个
+scheduler = LLMScheduler()
+
+def scheduled(client, priority):
+    return ScheduledClient(client, scheduler, priority)
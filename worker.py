@@ -0,0 +1,55 @@
+"""
+后台 LLM 任务 worker：独立进程运行，与 Streamlit 共享 tickets.db。
+
+    python worker.py --concurrency 4
+"""
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import jobs
+from llm import load_api_key, make_client, run_extraction, run_critique
+from scheduler import PRIORITY_BACKGROUND, scheduled
+
+log = logging.getLogger("worker")
+
+
+def run_job(client, job_id, ticket_id, kind, messages):
+    try:
+        if kind == jobs.JOB_EXTRACTION:
+            result = run_extraction(client, messages)
+        else:
+            result = run_critique(client, messages)
+        jobs.complete(job_id, ticket_id, kind, result)
+        log.info("job #%s (%s, ticket #%s) done", job_id, kind, ticket_id)
+    except Exception as e:
+        log.warning("job #%s (%s, ticket #%s) failed: %s", job_id, kind, ticket_id, e)
+        jobs.fail(job_id, e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PIA 后台 LLM 任务 worker")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时在途的 LLM 请求上限")
+    parser.add_argument("--poll", type=float, default=2.0, help="空闲时轮询间隔（秒）")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    client = scheduled(make_client(load_api_key()), PRIORITY_BACKGROUND)
+    db.get_conn()  # 启动即完成迁移，库文件有问题时尽早报错
+
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="job") as pool:
+        while True:
+            in_flight = {f for f in in_flight if not f.done()}
+            free = args.concurrency - len(in_flight)
+            claimed = jobs.claim(free) if free > 0 else []
+            for job in claimed:
+                in_flight.add(pool.submit(run_job, client, *job))
+            if not claimed:
+                time.sleep(args.poll)
+
+
+if __name__ == "__main__":
+    main()